@@ -0,0 +1,134 @@
+"""Parser throughput benchmarks on synthetic hand histories.
+
+    python bench.py                        # 1k, 100k and 1M hands
+    python bench.py --sizes 1000 --save-baseline bench_baseline.json
+    python bench.py --sizes 1000 --baseline bench_baseline.json
+
+Every case runs in a fresh process, so the reported peak memory is the
+growth of that process' maximum resident set size during the case.
+Generated hand histories are kept in --data and reused between runs.
+"""
+import os
+import sys
+import json
+import time
+import argparse
+import resource
+from concurrent.futures import ProcessPoolExecutor
+
+from azpoker import hhgen
+from azpoker import pokerstars_parser
+
+CASES = ['parse_hand', 'parse_hhfile', 'parse_directory']
+DEFAULT_SIZES = [1000, 100000, 1000000]
+
+
+def _maxrss():
+    # kilobytes on Linux, bytes on macOS
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return rss if sys.platform == 'darwin' else rss * 1024
+
+def make_data(datadir, nhands, seed=0):
+    """Generates (once) the single file and the directory tree for nhands and
+    returns their paths."""
+    fn = os.path.join(datadir, 'file_{}.txt'.format(nhands))
+    directory = os.path.join(datadir, 'dir_{}'.format(nhands))
+    if not os.path.exists(fn):
+        os.makedirs(datadir, exist_ok=True)
+        hhgen.generate_file(fn + '.tmp', nhands, seed=seed, maxseats=9, ante_prob=0.3)
+        os.replace(fn + '.tmp', fn)
+    if not os.path.exists(os.path.join(directory, 'done')):
+        hhgen.generate_directory(directory, nhands, seed=seed)
+        open(os.path.join(directory, 'done'), 'w').close()
+    return fn, directory
+
+def _run_case(case, fn, directory, parser, workers):
+    """Runs one case in the current process; returns (hands, errors, seconds, peak bytes)."""
+    rss0 = _maxrss()
+    nerr = 0
+    if case == 'parse_hand':
+        # only the parse calls are timed, reading is not
+        parse = pokerstars_parser.PARSERS[parser]
+        nhands = 0
+        elapsed = 0.
+        for hand in pokerstars_parser.iter_hands(fn):
+            t0 = time.perf_counter()
+            try:
+                parse(hand)
+                nhands += 1
+            except pokerstars_parser.HandParseException:
+                nerr += 1
+            elapsed += time.perf_counter() - t0
+    elif case == 'parse_hhfile':
+        t0 = time.perf_counter()
+        res, errors = pokerstars_parser.parse_hhfile(fn, parser)
+        elapsed = time.perf_counter() - t0
+        nhands, nerr = len(res), len(errors)
+    elif case == 'parse_directory':
+        t0 = time.perf_counter()
+        res, errcounts, _ = pokerstars_parser.parse_directory(
+            directory, verbosity=0, workers=workers, parser=parser)
+        elapsed = time.perf_counter() - t0
+        nhands, nerr = len(res), sum(errcounts.values())
+    else:
+        raise ValueError("Unknown case: {}".format(case))
+    return nhands, nerr, elapsed, _maxrss() - rss0
+
+def run(sizes, cases=CASES, parser='regex', workers=None, datadir='bench_data'):
+    """Runs every case at every size; returns {'case/parser/size': result}."""
+    results = {}
+    for nhands in sizes:
+        fn, directory = make_data(datadir, nhands)
+        for case in cases:
+            with ProcessPoolExecutor(max_workers=1) as pool:
+                parsed, nerr, elapsed, peak = pool.submit(
+                    _run_case, case, fn, directory, parser, workers).result()
+            key = '{}/{}/{}'.format(case, parser, nhands)
+            results[key] = {'hands': parsed, 'errors': nerr, 'seconds': elapsed,
+                            'hands_per_sec': parsed / elapsed if elapsed else 0.,
+                            'peak_mb': peak / 2**20}
+            print("{:<40} {:>10,} hands {:>10,.0f} hands/s {:>9.1f} MB peak".format(
+                key, parsed, results[key]['hands_per_sec'], results[key]['peak_mb']))
+    return results
+
+def compare(results, baseline, tolerance=0.1):
+    """Prints results against a baseline; returns the keys that regressed by
+    more than tolerance in throughput or peak memory."""
+    regressions = []
+    for key, r in results.items():
+        if key not in baseline:
+            continue
+        b = baseline[key]
+        speed = r['hands_per_sec'] / b['hands_per_sec'] if b['hands_per_sec'] else 1.
+        mem = r['peak_mb'] / b['peak_mb'] if b['peak_mb'] > 1 else 1.
+        flag = ''
+        if speed < 1 - tolerance or mem > 1 + tolerance:
+            regressions.append(key)
+            flag = '  REGRESSION'
+        print("{:<40} speed x{:.2f}  memory x{:.2f}{}".format(key, speed, mem, flag))
+    return regressions
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    ap.add_argument('--sizes', type=int, nargs='+', default=DEFAULT_SIZES)
+    ap.add_argument('--cases', nargs='+', default=CASES, choices=CASES)
+    ap.add_argument('--parser', default='regex', choices=sorted(pokerstars_parser.PARSERS))
+    ap.add_argument('--workers', type=int, default=None)
+    ap.add_argument('--data', default='bench_data')
+    ap.add_argument('--baseline', help="JSON file of a previous run to compare against")
+    ap.add_argument('--save-baseline', help="write the results to this JSON file")
+    ap.add_argument('--tolerance', type=float, default=0.1)
+    args = ap.parse_args(argv)
+    results = run(args.sizes, args.cases, args.parser, args.workers, args.data)
+    if args.save_baseline:
+        with open(args.save_baseline, 'w') as f:
+            json.dump(results, f, indent=1, sort_keys=True)
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        if compare(results, baseline, args.tolerance):
+            return 1
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,158 @@
+"""Suit-isomorphism canonical forms and memoization of evaluator queries.
+
+Relabeling the suits of the hole cards and the board together doesn't
+change any percentile, so queries are cached under the canonical form of
+their (hole cards, board) masks and the cache is shared by all the suit
+variants of a spot.
+
+    from azpoker import canonical
+    canonical.load_caches('peval_cache.p')   # warm start, if it exists
+    ...
+    canonical.save_caches('peval_cache.p')
+    canonical.cache_stats()
+"""
+import os
+import pickle
+import inspect
+import functools
+import itertools
+from collections import OrderedDict
+
+SUIT_PERMS = list(itertools.permutations(range(4)))
+DEFAULT_CACHE_SIZE = 1000000
+# name -> MemoCache of every memoized function
+CACHES = {}
+
+
+def suit_masks(mask):
+    return [(mask >> (13 * s)) & 0x1FFF for s in range(4)]
+
+def permute_suits(mask, perm):
+    """mask with the cards of suit s moved to suit perm[s]."""
+    res = 0
+    for s, sm in enumerate(suit_masks(mask)):
+        res |= sm << (13 * perm[s])
+    return res
+
+def canonical_mask(mask):
+    """The smallest of the masks equivalent to mask under a relabeling of the
+    suits: its suit masks sorted in decreasing order."""
+    suits = sorted(suit_masks(mask), reverse=True)
+    return suits[0] | (suits[1] << 13) | (suits[2] << 26) | (suits[3] << 39)
+
+def canonical_perm(mask):
+    """A suit permutation taking mask to canonical_mask(mask), to be applied
+    to the masks that go with it (see permute_suits)."""
+    sms = suit_masks(mask)
+    order = sorted(range(4), key=lambda s: sms[s], reverse=True)
+    perm = [0] * 4
+    for i, s in enumerate(order):
+        perm[s] = i
+    return tuple(perm)
+
+def canonical_pair(hc_mask, board_mask):
+    """The smallest (board, hole cards) among the joint suit relabelings of
+    the two masks, as (hole cards, board)."""
+    hs, bs = suit_masks(hc_mask), suit_masks(board_mask)
+    best = None
+    for perm in SUIT_PERMS:
+        # the suit that ends up on top decides first, so compare suit by
+        # suit from the highest
+        key = tuple(bs[perm.index(s)] for s in (3, 2, 1, 0)) + \
+            tuple(hs[perm.index(s)] for s in (3, 2, 1, 0))
+        if best is None or key < best[0]:
+            best = (key, perm)
+    perm = best[1]
+    return permute_suits(hc_mask, perm), permute_suits(board_mask, perm)
+
+
+class MemoCache:
+    """A size-capped LRU cache with hit/miss counts."""
+
+    def __init__(self, maxsize=DEFAULT_CACHE_SIZE):
+        self.maxsize = maxsize
+        self.data = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key, default=None):
+        try:
+            value = self.data[key]
+        except KeyError:
+            self.misses += 1
+            return default
+        self.data.move_to_end(key)
+        self.hits += 1
+        return value
+
+    def put(self, key, value):
+        if self.maxsize <= 0:
+            return
+        self.data[key] = value
+        self.data.move_to_end(key)
+        while len(self.data) > self.maxsize:
+            self.data.popitem(last=False)
+
+    def clear(self):
+        self.data.clear()
+        self.hits = self.misses = 0
+
+    def __len__(self):
+        return len(self.data)
+
+    def __repr__(self):
+        return "MemoCache({}/{} entries, {} hits, {} misses)".format(
+            len(self), self.maxsize, self.hits, self.misses)
+
+
+_MISSING = object()
+
+def memoize(name, key_func, maxsize=DEFAULT_CACHE_SIZE):
+    """Caches a function in CACHES[name] under key_func(*args), with args
+    bound to the function's signature and defaults applied. Calls for which
+    key_func returns None are not cached."""
+    def decorator(func):
+        sig = inspect.signature(func)
+        cache = CACHES.setdefault(name, MemoCache(maxsize))
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            bound = sig.bind(*args, **kwargs)
+            bound.apply_defaults()
+            key = key_func(*bound.args)
+            if key is None:
+                return func(*args, **kwargs)
+            value = cache.get(key, _MISSING)
+            if value is _MISSING:
+                value = func(*args, **kwargs)
+                cache.put(key, value)
+            return value
+        wrapper.cache = cache
+        return wrapper
+    return decorator
+
+def cache_stats():
+    return {name: {'size': len(c), 'hits': c.hits, 'misses': c.misses}
+            for name, c in CACHES.items()}
+
+def clear_caches():
+    for cache in CACHES.values():
+        cache.clear()
+
+def save_caches(fn):
+    """Writes the entries of all the caches to fn, most recently used last."""
+    data = {name: list(c.data.items()) for name, c in CACHES.items()}
+    with open(fn + '.tmp', 'wb') as f:
+        pickle.dump(data, f, pickle.HIGHEST_PROTOCOL)
+    os.replace(fn + '.tmp', fn)
+
+def load_caches(fn):
+    """Adds the entries saved in fn to the caches; a missing file is ignored."""
+    if not os.path.exists(fn):
+        return
+    with open(fn, 'rb') as f:
+        data = pickle.load(f)
+    for name, items in data.items():
+        cache = CACHES.setdefault(name, MemoCache())
+        for key, value in items:
+            cache.put(key, value)
@@ -0,0 +1,135 @@
+"""Hand-vs-hand showdown equity matrices and range-vs-range equity.
+
+    m = equity_matrix(strhand_to_mask('AhKd7c'))
+    range_equity(strhand_to_mask('AhKd7c'), 'TT+, AKs', '22+, A2s+, KQo')
+
+equity_matrix(board)[i, j] is the equity of combo i against combo j
+(COMBO_MASKS order) on a 3 to 5 card board, averaged over all the runouts
+to the river that neither hand blocks, stored as uint16 in units of
+1/EQUITY_SCALE, with BLOCKED where the combos share a card or hold a board
+card. Every combo is evaluated once per runout board, and the pairwise
+comparisons are accumulated over the runouts as whole matrices.
+
+Matrices are cached on disk as .npy files (3.4 MB each) under the
+suit-canonical board, so the suit variants of a board share one file.
+The cache is in EQUITY_DIR: $AZPOKER_EQUITY_DIR if set, else
+equity_matrices in the user cache directory ($XDG_CACHE_HOME or
+~/.cache).
+"""
+import os
+import sys
+import argparse
+import functools
+import numpy as np
+from azpoker import peval
+from azpoker import ranktable
+from azpoker.canonical import canonical_mask, canonical_perm, permute_suits
+from azpoker.handrange import COMBO_MASKS, COMBO_INDEX, combo_weights
+
+EQUITY_DIR = os.environ.get('AZPOKER_EQUITY_DIR') or os.path.join(
+    os.environ.get('XDG_CACHE_HOME') or os.path.expanduser('~/.cache'),
+    'azpoker', 'equity_matrices')
+EQUITY_SCALE = 0xFFFE
+BLOCKED = 0xFFFF
+
+
+def compute_matrix(board_mask):
+    """The equity matrix of a board (see the module docstring)."""
+    nboard = bin(board_mask).count('1')
+    if not 3 <= nboard <= 5:
+        raise ValueError("Board has {} cards, equity matrices need 3 to 5".format(nboard))
+    deck = tuple(c for c in range(52) if not (board_mask >> c) & 1)
+    boards = ranktable.subset_masks(deck, 5 - nboard) | board_mask
+    n = len(COMBO_MASKS)
+    ok = (boards[:, None] & COMBO_MASKS) == 0
+    values = peval.evaluate_values((boards[:, None] | COMBO_MASKS)[ok])
+    # dense ranks fit int16; -1 marks the combos a runout blocks
+    _, ranks = np.unique(values, return_inverse=True)
+    rank = np.full(ok.shape, -1, dtype=np.int16)
+    rank[ok] = ranks
+    # sum over the runouts of sign(rank i - rank j)
+    sign = np.zeros((n, n), dtype=np.int16)
+    for v in rank:
+        d = np.subtract.outer(v, v)
+        np.sign(d, out=d)
+        sign += d
+    # wins + ties / 2 over all runouts is (runouts + sign) / 2; take out the
+    # runouts where one of the hands is blocked: i live and j blocked counts
+    # as a win, both blocked as a tie
+    live = ok.astype(np.float32)
+    dead = 1 - live
+    both = live.T @ live
+    eqsum = (len(boards) + sign) / 2 - live.T @ dead - (dead.T @ dead) / 2
+    with np.errstate(invalid='ignore', divide='ignore'):
+        eq = eqsum / both
+    res = np.full((n, n), BLOCKED, dtype=np.uint16)
+    valid = (both > 0) & ((COMBO_MASKS[:, None] & COMBO_MASKS) == 0)
+    res[valid] = np.rint(eq[valid] * EQUITY_SCALE)
+    return res
+
+@functools.lru_cache(maxsize=24)
+def _combo_perm(perm):
+    """index[i]: the combo that combo i becomes when its suits are permuted."""
+    return np.array([COMBO_INDEX[permute_suits(int(m), perm)] for m in COMBO_MASKS],
+                    dtype=np.intp)
+
+def matrix_fn(board_mask, cache_dir=EQUITY_DIR):
+    return os.path.join(cache_dir, '{:013x}.npy'.format(canonical_mask(board_mask)))
+
+def _canonical_matrix(board_mask, cache_dir):
+    """(matrix of the canonical board, combo index of every combo in it)."""
+    perm = canonical_perm(board_mask)
+    canon = permute_suits(board_mask, perm)
+    fn = None if cache_dir is None else matrix_fn(canon, cache_dir)
+    if fn is not None and os.path.exists(fn):
+        m = np.load(fn, mmap_mode='r')
+    else:
+        m = compute_matrix(canon)
+        if fn is not None:
+            os.makedirs(cache_dir, exist_ok=True)
+            np.save(fn + '.tmp.npy', m)
+            os.replace(fn + '.tmp.npy', fn)
+    return m, _combo_perm(perm)
+
+def equity_matrix(board_mask, cache_dir=EQUITY_DIR):
+    """The uint16 equity matrix of a board, computed for its canonical form
+    once and then read from cache_dir (None to not cache)."""
+    m, index = _canonical_matrix(board_mask, cache_dir)
+    return m[np.ix_(index, index)]
+
+def equities(matrix):
+    """An equity matrix as floats, NaN where BLOCKED."""
+    res = matrix / np.float32(EQUITY_SCALE)
+    res[matrix == BLOCKED] = np.nan
+    return res
+
+def range_equity(board_mask, hero, villain, cache_dir=EQUITY_DIR):
+    """Equity of the hero range against the villain range on a board, over
+    all their pairs of combos that don't block each other or the board,
+    weighted by the product of their weights.
+
+    Ranges are Ranges, lists of masks or range notation.
+    """
+    m, index = _canonical_matrix(board_mask, cache_dir)
+    wh, wv = combo_weights(hero), combo_weights(villain)
+    hi, vi = np.flatnonzero(wh), np.flatnonzero(wv)
+    # only the rows and columns of the two ranges are read
+    sub = m[np.ix_(index[hi], index[vi])]
+    valid = sub != BLOCKED
+    w = wh[hi, None] * wv[None, vi] * valid
+    if not w.sum():
+        raise ValueError("No pair of live combos")
+    return float(np.sum(w * np.where(valid, sub, 0)) / EQUITY_SCALE / w.sum())
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(description="Fills the equity matrix cache for boards.")
+    ap.add_argument('boards', nargs='+', help="boards such as AhKd7c")
+    ap.add_argument('--cache-dir', default=EQUITY_DIR)
+    args = ap.parse_args(argv)
+    for board in args.boards:
+        equity_matrix(peval.strhand_to_mask(board), args.cache_dir)
+        print(board, matrix_fn(peval.strhand_to_mask(board), args.cache_dir))
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
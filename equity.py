@@ -0,0 +1,153 @@
+"""All-in equity of hands and ranges against each other.
+
+    equity([strhand_to_mask('AhAs'), strhand_to_mask('KdKc')])
+    equity([hero_mask, villain_range], board=board_mask, workers=4)
+
+Every player is a hand mask, a handrange.Range or a list of hand masks.
+When the number of deals x runouts is at most exhaustive_limit all of
+them are evaluated; otherwise deals and runouts are sampled (Monte Carlo)
+until the standard error of every player's equity is below target_error.
+Every batch of samples has its own seed derived from seed, so a run is
+reproducible for the same number of workers.
+"""
+from math import comb
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+from azpoker import peval
+from azpoker import ranktable
+from azpoker.handrange import live_range
+
+EXHAUSTIVE_LIMIT = 10000000
+# evaluated deal x runout pairs per chunk
+CHUNK_SIZE = 1 << 18
+MC_BATCH_SIZE = 50000
+MC_MAX_TRIALS = 20000000
+
+
+def _player_combos(player, dead_mask):
+    """(masks, weights) of the combos of a player that don't hold dead cards."""
+    if isinstance(player, (int, np.integer)):
+        player = [player]
+    return live_range(player, dead_mask)
+
+def _shares(deals, runouts):
+    """Pot shares of every player of every deal with its runout, shape (n, players)."""
+    values = peval.evaluate_values((deals | runouts[:, None]).ravel()).reshape(deals.shape)
+    winners = values == values.max(axis=1)[:, None]
+    return winners / winners.sum(axis=1)[:, None]
+
+def _deals(combos, limit):
+    """All the combinations of one combo per player without shared cards, as
+    (deals, weights), or None when there are more than limit of them."""
+    deals = combos[0][0][:, None]
+    weights = combos[0][1]
+    for masks, w in combos[1:]:
+        if len(deals) * len(masks) > limit:
+            return None
+        i, j = np.divmod(np.arange(len(deals) * len(masks)), len(masks))
+        used = np.bitwise_or.reduce(deals, axis=1)
+        ok = (used[i] & masks[j]) == 0
+        i, j = i[ok], j[ok]
+        deals = np.concatenate([deals[i], masks[j, None]], axis=1)
+        weights = weights[i] * w[j]
+    return deals, weights
+
+def _exhaustive_task(deals, weights, deck, k, board_mask, lo, hi):
+    """Weighted share sums over all the deals x runouts[lo:hi]."""
+    runouts = ranktable.subset_masks(deck, k)[lo:hi] | board_mask
+    used = np.bitwise_or.reduce(deals, axis=1)
+    total = np.zeros(deals.shape[1])
+    wsum = 0.
+    step = max(1, CHUNK_SIZE // len(deals))
+    for r in range(0, len(runouts), step):
+        i, j = np.divmod(np.arange(len(deals) * len(runouts[r:r+step])),
+                         len(runouts[r:r+step]))
+        ok = (used[i] & runouts[r:r+step][j]) == 0
+        i, j = i[ok], j[ok]
+        shares = _shares(deals[i], runouts[r:r+step][j])
+        total += weights[i] @ shares
+        wsum += weights[i].sum()
+    return total, wsum
+
+def _mc_task(combos, board_mask, dead_mask, k, n, seed):
+    """Share sums and sums of squares over n sampled deals and runouts."""
+    rng = np.random.default_rng(seed)
+    picks = [rng.choice(len(masks), size=n, p=w / w.sum()) for masks, w in combos]
+    deals = np.stack([masks[p] for (masks, _), p in zip(combos, picks)], axis=1)
+    # drop the deals where players share cards
+    used = np.zeros(n, dtype=np.int64)
+    ok = np.ones(n, dtype=bool)
+    for col in deals.T:
+        ok &= (used & col) == 0
+        used |= col
+    deals, used = deals[ok], used[ok] | board_mask | dead_mask
+    runouts = np.full(len(deals), board_mask, dtype=np.int64)
+    if k:
+        # k random cards out of the unused ones for every deal
+        keys = rng.random((len(deals), 52))
+        keys[((used[:, None] >> np.arange(52)) & 1).astype(bool)] = 2.
+        cards = np.argpartition(keys, k, axis=1)[:, :k]
+        runouts |= np.bitwise_or.reduce(np.int64(1) << cards, axis=1)
+    shares = _shares(deals, runouts)
+    return shares.sum(axis=0), (shares ** 2).sum(axis=0), len(deals)
+
+def equity(players, board=0, dead=0, workers=None, exhaustive_limit=EXHAUSTIVE_LIMIT,
+           target_error=1e-3, max_trials=MC_MAX_TRIALS, seed=0):
+    """Equity of every player, as (equities, stderr).
+
+    board and dead are card masks. stderr is the largest standard error of
+    the Monte Carlo estimates, 0. when the equities are exact.
+    """
+    nboard = bin(board).count('1')
+    if nboard > 5:
+        raise ValueError("Board has {} cards".format(nboard))
+    k = 5 - nboard
+    combos = [_player_combos(p, board | dead) for p in players]
+    for i, (masks, _) in enumerate(combos):
+        if not len(masks):
+            raise ValueError("Player {} has no live combos".format(i))
+    deck = tuple(c for c in range(52) if not ((board | dead) >> c) & 1)
+    nrunouts = comb(len(deck), k)
+    nparts = max(workers or 1, 1)
+    pool = ProcessPoolExecutor(max_workers=workers) if nparts > 1 else None
+
+    def run(func, args):
+        if pool is None:
+            return [func(*a) for a in args]
+        return list(pool.map(func, *zip(*args)))
+
+    try:
+        dealt = _deals(combos, exhaustive_limit // nrunouts)
+        if dealt is not None and len(dealt[0]) * nrunouts <= exhaustive_limit:
+            deals, weights = dealt
+            if not len(deals):
+                raise ValueError("No deal without shared cards")
+            bounds = np.linspace(0, nrunouts, nparts * 4 + 1).astype(int)
+            results = run(_exhaustive_task, [(deals, weights, deck, k, board, lo, hi)
+                                             for lo, hi in zip(bounds[:-1], bounds[1:])
+                                             if hi > lo])
+            return sum(r[0] for r in results) / sum(r[1] for r in results), 0.
+        batch = 0
+        sums = np.zeros(len(players))
+        sumsq = np.zeros(len(players))
+        n = 0
+        stderr = np.inf
+        while batch * MC_BATCH_SIZE < max_trials:
+            args = [(combos, board, dead, k, MC_BATCH_SIZE, [seed, batch + i])
+                    for i in range(nparts)]
+            batch += nparts
+            for s, sq, m in run(_mc_task, args):
+                sums += s
+                sumsq += sq
+                n += m
+            if n:
+                mean = sums / n
+                stderr = np.sqrt(np.maximum(sumsq / n - mean ** 2, 0) / n).max()
+                if stderr <= target_error:
+                    break
+        if not n:
+            raise ValueError("No deal without shared cards")
+        return sums / n, stderr
+    finally:
+        if pool is not None:
+            pool.shutdown()
@@ -0,0 +1,260 @@
+"""Features of every hero decision, for model training.
+
+    for df in iter_features(hands, workers=4):
+        ...
+    df = directory_features('hh', workers=4)
+
+    python -m azpoker.features hh --workers 4 --out features.p
+
+A spot is one action of the hero, with the pot, the amount to call and the
+stacks just before it (replayed from act_dict) and the hero's hand
+strength on the board of its street. The evaluator work of a chunk of
+spots is deduplicated by suit-canonical (board, hole cards) and batched
+per board: the opponent holdings are evaluated once on the board and once
+over all the runout cards for all the hero hands on that board. Results
+are cached across chunks (canonical.CACHES['spot_strength']), and chunks
+are evaluated in parallel with workers > 1.
+"""
+import sys
+import time
+import argparse
+import functools
+import collections
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+import pandas as pd
+from azpoker import peval
+from azpoker import pokerstars_parser
+from azpoker.canonical import canonical_perm, permute_suits, MemoCache, CACHES
+from azpoker.handrange import hand_class
+from azpoker.handstore import STREETS
+
+CHUNK_SIZE = 5000
+# feature column -> dtype; position and action are categorical
+FEATURES = [
+    ('hand_no', np.int64),
+    ('street', np.int8),
+    ('seq', np.int16),
+    ('position', 'category'),
+    ('nplayers', np.int8),
+    ('bb', np.float64),
+    ('pot', np.float64),
+    ('to_call', np.float64),
+    ('pot_odds', np.float64),
+    ('stack', np.float64),
+    ('eff_stack', np.float64),
+    ('spr', np.float64),
+    ('hand_class', np.int16),
+    ('pctile', np.float64),  # NaN preflop
+    ('fwd_pctile', np.float64),  # mean over the next card, NaN preflop and on the river
+    ('action', 'category'),
+    ('amount', np.float64),  # NaN for actions without an amount
+]
+# spot columns built by hand_spots, then the cards
+SPOT_COLUMNS = ['hand_no', 'street', 'seq', 'position', 'nplayers', 'bb', 'pot', 'to_call',
+                'stack', 'eff_stack', 'action', 'amount', 'hc', 'board']
+
+
+def board_masks(board):
+    """Board mask of every street from the board string of a parsed hand."""
+    board = board or ''
+    return [0] + [peval.strhand_to_mask(board[:n]) if len(board) >= n else None
+                  for n in (6, 8, 10)]
+
+def _remaining(stacks, invested, name):
+    # to the cent, so an all-in stack is 0 rather than a float residue
+    return max(0., round(stacks[name] - invested[name], 2))
+
+def hand_spots(d):
+    """Spot rows (see SPOT_COLUMNS) of the hero's actions in a parsed hand."""
+    hero = d['hero']
+    if hero is None or hero not in d['holecards']:
+        return []
+    hc = peval.strhand_to_mask(d['holecards'][hero])
+    boards = board_masks(d['board'])
+    stacks = d['stacks']
+    # invested so far in the hand and on the current street; antes are dead
+    # money and don't count towards calls
+    invested = dict(d['post_dict'])
+    street_inv = {name: amt - d['ante'] - d['extra_antes'][name]
+                  for name, amt in d['post_dict'].items()}
+    pot = sum(invested.values())
+    himark = max(street_inv.values())
+    folded = set()
+    rows = []
+    for code, street in enumerate(STREETS):
+        actions = d['act_dict'].get(street)
+        if actions is None:
+            break
+        if code:
+            street_inv = {}
+            himark = 0.
+        for seq, (name, action, amt, pot_now, himark_now) in enumerate(actions):
+            if name == hero:
+                stack = _remaining(stacks, invested, hero)
+                others = [_remaining(stacks, invested, n) for n in stacks
+                          if n != hero and n not in folded]
+                eff_stack = min(stack, max(others)) if others else stack
+                to_call = min(max(himark - street_inv.get(hero, 0.), 0.), stack)
+                rows.append((d['hand_no'], code, seq, d['relpos_dict'][hero], len(d['sd_dict']),
+                             d['bb'], pot, to_call, stack, eff_stack, action,
+                             np.nan if amt is None else amt, hc, boards[code]))
+            if action == 'fold':
+                folded.add(name)
+            elif amt is not None:
+                before = street_inv.get(name, 0.)
+                after = himark_now if action == 'raise' else before + amt
+                invested[name] += after - before
+                street_inv[name] = after
+            pot = pot_now
+            himark = himark_now
+    return rows
+
+# (canonical board, canonical hole cards) -> (pctile, fwd_pctile)
+SPOT_CACHE = CACHES.setdefault('spot_strength', MemoCache())
+
+def _pctiles(hero, others, live):
+    """Share of the live others that every hero value beats, ties counting
+    half; hero is (k,) and others and live (k, n) or broadcastable."""
+    wins = np.sum(live & (hero[:, None] > others), axis=1)
+    ties = np.sum(live & (hero[:, None] == others), axis=1)
+    return (wins + ties / 2) / np.sum(live, axis=1)
+
+def board_strengths(board_mask, hcs):
+    """(pctiles, fwd_pctiles) of every hole cards mask of hcs on a board,
+    against every other holding like get_high_pctile and the mean of
+    calc_forward_value; fwd_pctiles is NaN on the river.
+
+    The holdings are evaluated once for all of hcs: on the board, then on
+    every runout card as one batch.
+    """
+    hcs = np.asarray(hcs, dtype=np.int64)
+    others = peval.HOLDING_MASKS[(peval.HOLDING_MASKS & board_mask) == 0]
+    live = (hcs[:, None] & others) == 0
+    values = peval.evaluate_values(np.concatenate([hcs, others]) | board_mask)
+    pctiles = _pctiles(values[:len(hcs)], values[None, len(hcs):], live)
+    fwd = np.full(len(hcs), np.nan)
+    if bin(board_mask).count('1') >= 5:
+        return pctiles, fwd
+    runouts = np.array([1 << c for c in range(52) if not (board_mask >> c) & 1], dtype=np.int64)
+    ok = (runouts[:, None] & others) == 0
+    hero_ok = (runouts[:, None] & hcs) == 0
+    masks = np.concatenate([((runouts[:, None] | hcs) | board_mask)[hero_ok],
+                            ((runouts[:, None] | others) | board_mask)[ok]])
+    values = peval.evaluate_values(masks)
+    hero = np.zeros(hero_ok.shape, dtype=values.dtype)
+    hero[hero_ok] = values[:hero_ok.sum()]
+    res = np.zeros(ok.shape, dtype=values.dtype)
+    res[ok] = values[hero_ok.sum():]
+    for i in range(len(hcs)):
+        r = hero_ok[:, i]
+        fwd[i] = np.mean(_pctiles(hero[r, i], res[r], ok[r] & live[i]))
+    return pctiles, fwd
+
+def spot_strengths(hcs, boards, streets):
+    """(pctiles, fwd_pctiles) of the hole cards of every spot.
+
+    Spots are keyed by suit-canonical board and the hole cards relabeled
+    the same way, so suit variants share their evaluation, and the spots
+    missing from SPOT_CACHE are evaluated together per board.
+    """
+    pctiles = np.full(len(hcs), np.nan)
+    fwd = np.full(len(hcs), np.nan)
+    keys = {}
+    for i, (hc, board, street) in enumerate(zip(hcs, boards, streets)):
+        if street:
+            perm = canonical_perm(board)
+            keys[i] = (permute_suits(board, perm), permute_suits(int(hc), perm))
+    found = {}
+    missing = collections.defaultdict(set)
+    for key in set(keys.values()):
+        found[key] = SPOT_CACHE.get(key)
+        if found[key] is None:
+            missing[key[0]].add(key[1])
+    for board, board_hcs in missing.items():
+        board_hcs = sorted(board_hcs)
+        for hc, p, f in zip(board_hcs, *board_strengths(board, board_hcs)):
+            found[board, hc] = (p, f)
+            SPOT_CACHE.put((board, hc), (p, f))
+    for i, key in keys.items():
+        pctiles[i], fwd[i] = found[key]
+    return pctiles, fwd
+
+def chunk_features(spots):
+    """Feature table of a list of spot rows (see hand_spots)."""
+    cols = dict(zip(SPOT_COLUMNS, zip(*spots))) if spots else \
+        {col: [] for col in SPOT_COLUMNS}
+    hcs = np.array(cols.pop('hc'), dtype=np.int64)
+    boards = cols.pop('board')
+    df = pd.DataFrame(cols)
+    df['pot_odds'] = df['to_call'] / (df['pot'] + df['to_call'])
+    df['spr'] = df['eff_stack'] / df['pot']
+    df['hand_class'] = [hand_class(hc) for hc in hcs]
+    df['pctile'], df['fwd_pctile'] = spot_strengths(hcs, boards, df['street'].to_numpy())
+    return df[[col for col, _ in FEATURES]].astype(dict(FEATURES))
+
+def _chunks(items, size):
+    chunk = []
+    for x in items:
+        chunk.append(x)
+        if len(chunk) >= size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+def iter_features(hands, chunk_size=CHUNK_SIZE, workers=None):
+    """Yields the feature tables of a stream of parsed hands, chunk by chunk.
+
+    The spots are replayed here and their evaluation is spread over a
+    pool of workers processes, with at most two chunks per worker in
+    flight.
+    """
+    spots = (row for d in hands for row in hand_spots(d))
+    chunks = _chunks(spots, chunk_size)
+    if not workers or workers < 2:
+        for chunk in chunks:
+            yield chunk_features(chunk)
+        return
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        pending = collections.deque()
+        for chunk in chunks:
+            pending.append(pool.submit(chunk_features, chunk))
+            if len(pending) >= 2 * workers:
+                yield pending.popleft().result()
+        while pending:
+            yield pending.popleft().result()
+
+def file_features(fn, parser='regex'):
+    """Feature table of the hands of a hand history file."""
+    res, _ = pokerstars_parser.parse_hhfile(fn, parser)
+    return chunk_features([row for d in res for row in hand_spots(d)])
+
+def directory_features(directory, workers=None, parser='regex'):
+    """Feature table of all the hand history files under directory, one
+    file per job (parsing included)."""
+    fns = pokerstars_parser.find_hhfiles(directory)
+    tables = list(pokerstars_parser.map_files(
+        functools.partial(file_features, parser=parser), fns, workers))
+    if not tables:
+        return chunk_features([])
+    return pd.concat(tables, ignore_index=True)
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(description="Extracts the decision features of a directory.")
+    ap.add_argument('directory')
+    ap.add_argument('--workers', type=int, default=None)
+    ap.add_argument('--parser', default='regex', choices=sorted(pokerstars_parser.PARSERS))
+    ap.add_argument('--out', help="write the table to this pickle file")
+    args = ap.parse_args(argv)
+    t0 = time.perf_counter()
+    df = directory_features(args.directory, args.workers, args.parser)
+    elapsed = time.perf_counter() - t0
+    print("{:,} spots in {:.1f} s: {:,.0f} spots/s".format(len(df), elapsed,
+                                                           len(df) / elapsed if elapsed else 0.))
+    if args.out:
+        df.to_pickle(args.out)
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
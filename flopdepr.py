@@ -0,0 +1,75 @@
+"""Builds the flop depreciation tables used by peval.get_flop_depr.
+
+The depreciation of a flop is how much the hands at or above the
+threshold percentile on the flop lose on average by the turn: the mean,
+over those holdings, of their flop percentile minus their mean percentile
+over all the turn cards (percentiles without reduce_splits).
+
+    python -m azpoker.flopdepr --threshold 85 --workers 8
+
+writes flop_depr_85.npy next to the package, one entry per suit-canonical
+flop (1755 of them).
+"""
+import sys
+import argparse
+import itertools
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+from azpoker import peval
+
+DEPR_DTYPE = [('flop', np.int64), ('depr', np.float64)]
+
+
+def canonical_flops():
+    """Sorted masks of all the suit-canonical flops."""
+    return sorted(set(peval.canonical_mask(peval.codes_to_mask(x))
+                      for x in itertools.combinations(range(52), 3)))
+
+def flop_depreciation(flop_mask, threshold=85):
+    holdings, now = peval.rank_board(flop_mask, reduce_splits=False)
+    order = np.argsort(holdings)
+    sums = np.zeros(len(holdings))
+    counts = np.zeros(len(holdings))
+    for card in range(52):
+        if (flop_mask >> card) & 1:
+            continue
+        turn_holdings, pctiles = peval.rank_board(flop_mask | (1 << card), reduce_splits=False)
+        i = order[np.searchsorted(holdings, turn_holdings, sorter=order)]
+        sums[i] += pctiles
+        counts[i] += 1
+    top = now >= threshold / 100
+    return np.mean(now[top] - sums[top] / counts[top])
+
+def build_table(fn, threshold=85, workers=None, verbosity=1):
+    flops = canonical_flops()
+    table = np.zeros(len(flops), dtype=DEPR_DTYPE)
+    table['flop'] = flops
+    thresholds = [threshold] * len(flops)
+    if workers and workers > 1:
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            results = pool.map(flop_depreciation, flops, thresholds, chunksize=16)
+            for i, depr in enumerate(results):
+                table['depr'][i] = depr
+                if verbosity:
+                    print("{}/{}".format(i + 1, len(flops)), end='\r')
+    else:
+        for i, depr in enumerate(map(flop_depreciation, flops, thresholds)):
+            table['depr'][i] = depr
+            if verbosity:
+                print("{}/{}".format(i + 1, len(flops)), end='\r')
+    if verbosity:
+        print()
+    np.save(fn, table)
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(description="Builds a flop depreciation table.")
+    ap.add_argument('--threshold', type=int, default=peval.DEPR_THRESHOLD,
+                    help="percentile (0-100) of the hands that are followed")
+    ap.add_argument('--workers', type=int, default=None)
+    ap.add_argument('--out', help="defaults to flop_depr_<threshold>.npy next to the package")
+    args = ap.parse_args(argv)
+    build_table(args.out or peval.DEPR_FN.format(args.threshold), args.threshold, args.workers)
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,259 @@
+"""SQLite index of parsed hands, for lookups by player, table, hand number and time.
+
+    with HandIndex('hands.db') as idx:
+        idx.index_directory('hh', workers=4)
+        for hand_no in idx.find(player='villain', position='BB', table='Acamar V',
+                                start='2016-01-01', end='2016-02-01'):
+            d = idx.fetch(hand_no)
+
+Only the metadata of a hand is stored, with the file and byte range it
+came from, so the full hand is read back and parsed on demand. Indexing
+a directory is incremental like parse_directory with a manifest: only
+files that changed are read, from where the previous run stopped.
+"""
+import os
+import sqlite3
+import functools
+import pandas as pd
+from azpoker import pokerstars_parser
+from azpoker.pokerstars_parser import HandParseException
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS files (
+    id INTEGER PRIMARY KEY,
+    path TEXT UNIQUE NOT NULL,
+    size INTEGER,
+    mtime REAL,
+    offset INTEGER
+);
+CREATE TABLE IF NOT EXISTS hands (
+    hand_no INTEGER PRIMARY KEY,
+    file_id INTEGER,
+    offset INTEGER,
+    length INTEGER,
+    timestamp INTEGER,
+    table_name TEXT,
+    game TEXT,
+    sb REAL,
+    bb REAL,
+    currency TEXT,
+    hero TEXT,
+    totalpot REAL,
+    rake REAL,
+    nplayers INTEGER
+);
+CREATE TABLE IF NOT EXISTS seats (
+    hand_no INTEGER,
+    seat INTEGER,
+    player TEXT,
+    position TEXT,
+    stack REAL,
+    PRIMARY KEY (hand_no, seat)
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS winners (
+    hand_no INTEGER,
+    seq INTEGER,
+    player TEXT,
+    amount REAL,
+    PRIMARY KEY (hand_no, seq)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS hands_timestamp ON hands (timestamp);
+CREATE INDEX IF NOT EXISTS hands_table ON hands (table_name, timestamp);
+CREATE INDEX IF NOT EXISTS hands_hero ON hands (hero);
+CREATE INDEX IF NOT EXISTS seats_player ON seats (player, position);
+CREATE INDEX IF NOT EXISTS winners_player ON winners (player);
+"""
+
+
+def to_ns(ts):
+    """ns since the epoch of anything pd.Timestamp takes; naive times are
+    taken as US/Eastern like the hand histories."""
+    ts = pd.Timestamp(ts)
+    if ts.tz is None:
+        ts = ts.tz_localize('US/Eastern')
+    return ts.value
+
+def hand_rows(d, offset=None, length=None):
+    """The hands, seats and winners rows of a parsed hand (file_id is filled
+    in on insert)."""
+    hand_no = d['hand_no']
+    hand = (hand_no, offset, length, to_ns(d['timestamp']), d['table_name'], d['game'],
+            d['sb'], d['bb'], d['currency'], d['hero'], d['totalpot'], d['rake'],
+            len(d['sd_dict']))
+    relpos = d['relpos_dict']
+    seats = [(hand_no, seat, name, relpos.get(name), d['stacks'].get(name))
+             for seat, name in d['sd_dict'].items()]
+    winners = [(hand_no, i, name, amt) for i, (name, amt) in enumerate(d['winners'])]
+    return hand, seats, winners
+
+def index_job(job, parser='regex'):
+    """Parses the finished hands of a plan_incremental job into rows.
+
+    Returns (rows, nerrors, end) like parse_hhfile_tail.
+    """
+    fn, offset, _, _, final = job
+    parse = pokerstars_parser.PARSERS[parser]
+    rows = []
+    nerrors = 0
+    end = offset
+    try:
+        with pokerstars_parser.open_hhfile(fn) as f:
+            encoding = pokerstars_parser.detect_encoding(f)
+            f.seek(offset)
+            for start, stop, raw in pokerstars_parser.iter_finished_hands(f, offset, final):
+                try:
+                    rows.append(hand_rows(parse(pokerstars_parser.decode_hand(raw, encoding)),
+                                          start, stop - start))
+                except HandParseException:
+                    nerrors += 1
+                end = stop
+    except pokerstars_parser.STREAM_ERRORS:
+        return [], -1, offset
+    return rows, nerrors, end
+
+
+class HandIndex:
+    """A SQLite database of hand metadata, with the source of every hand.
+
+    Inserts are batched in transactions of batch_size hands. hand_no is
+    the primary key, so a hand seen again (e.g. in a re-exported file) is
+    skipped by the primary key lookup.
+    """
+
+    def __init__(self, path, batch_size=10000):
+        self.path = path
+        self.batch_size = batch_size
+        self.conn = sqlite3.connect(path)
+        self.conn.executescript(SCHEMA)
+        self.pending = 0
+
+    def _file_id(self, fn):
+        fn = os.path.abspath(fn)
+        self.conn.execute("INSERT OR IGNORE INTO files (path) VALUES (?)", (fn,))
+        return self.conn.execute("SELECT id FROM files WHERE path = ?", (fn,)).fetchone()[0]
+
+    def insert_rows(self, rows, file_id=None):
+        """Inserts hand_rows() tuples; returns the number of new hands."""
+        before = self.conn.total_changes
+        hands = [(h[0], file_id) + h[1:] for h, _, _ in rows]
+        self.conn.executemany("INSERT OR IGNORE INTO hands VALUES "
+                              "(?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)", hands)
+        added = self.conn.total_changes - before
+        self.conn.executemany("INSERT OR IGNORE INTO seats VALUES (?, ?, ?, ?, ?)",
+                              [s for _, seats, _ in rows for s in seats])
+        self.conn.executemany("INSERT OR IGNORE INTO winners VALUES (?, ?, ?, ?)",
+                              [w for _, _, winners in rows for w in winners])
+        self.pending += len(rows)
+        if self.pending >= self.batch_size:
+            self.commit()
+        return added
+
+    def add(self, d, fn=None, offset=None, length=None):
+        file_id = None if fn is None else self._file_id(fn)
+        return self.insert_rows([hand_rows(d, offset, length)], file_id)
+
+    def extend(self, hands):
+        """Adds parsed hands without a source, so they can be a parse_directory sink."""
+        rows = []
+        for d in hands:
+            rows.append(hand_rows(d))
+            if len(rows) >= self.batch_size:
+                self.insert_rows(rows)
+                rows = []
+        self.insert_rows(rows)
+
+    def commit(self):
+        self.conn.commit()
+        self.pending = 0
+
+    def index_directory(self, directory, parser='regex', workers=None, verbosity=1):
+        """Indexes the new hands of every hand history file under directory.
+
+        Returns (new hands, hands that failed to parse, unreadable files).
+        """
+        hhfiles = pokerstars_parser.find_hhfiles(directory)
+        manifest = {path: {'size': size, 'mtime': mtime, 'offset': offset}
+                    for path, size, mtime, offset in self.conn.execute(
+                        "SELECT path, size, mtime, offset FROM files WHERE size IS NOT NULL")}
+        jobs = pokerstars_parser.plan_incremental(hhfiles, manifest)
+        if verbosity:
+            print("{} of {} files changed".format(len(jobs), len(hhfiles)))
+        results = pokerstars_parser.map_files(functools.partial(index_job, parser=parser),
+                                              jobs, workers)
+        nnew = nerrors = nskipped = 0
+        for i, (rows, errors, end) in enumerate(results):
+            fn, _, size, mtime, _ = jobs[i]
+            file_id = self._file_id(fn)
+            for j in range(0, len(rows), self.batch_size):
+                nnew += self.insert_rows(rows[j:j + self.batch_size], file_id)
+            if errors < 0:
+                nskipped += 1
+            else:
+                nerrors += errors
+                self.conn.execute("UPDATE files SET size = ?, mtime = ?, offset = ? "
+                                  "WHERE id = ?", (size, mtime, end, file_id))
+            if verbosity:
+                print("{}/{}: {:,} new hands".format(i + 1, len(jobs), nnew))
+        self.commit()
+        return nnew, nerrors, nskipped
+
+    def find(self, player=None, position=None, table=None, start=None, end=None,
+             hero=None, winner=None, limit=None):
+        """hand_nos of the hands matching all the given criteria, by time.
+
+        position only applies together with player (e.g. player X in the
+        BB); start and end are anything pd.Timestamp takes.
+        """
+        joins = []
+        conds = []
+        args = []
+        if player is not None:
+            joins.append("JOIN seats s ON s.hand_no = h.hand_no")
+            conds.append("s.player = ?")
+            args.append(player)
+            if position is not None:
+                conds.append("s.position = ?")
+                args.append(position)
+        if winner is not None:
+            joins.append("JOIN winners w ON w.hand_no = h.hand_no")
+            conds.append("w.player = ?")
+            args.append(winner)
+        for col, op, value in [('table_name', '=', table), ('hero', '=', hero),
+                               ('timestamp', '>=', start), ('timestamp', '<', end)]:
+            if value is not None:
+                conds.append("h.{} {} ?".format(col, op))
+                args.append(to_ns(value) if col == 'timestamp' else value)
+        q = "SELECT DISTINCT h.hand_no, h.timestamp FROM hands h " + " ".join(joins)
+        if conds:
+            q += " WHERE " + " AND ".join(conds)
+        q += " ORDER BY h.timestamp"
+        if limit is not None:
+            q += " LIMIT {:d}".format(limit)
+        return [row[0] for row in self.conn.execute(q, args)]
+
+    def fetch_text(self, hand_no):
+        """The text of a hand, read back from its source file (decompressing
+        up to the hand for compressed files)."""
+        row = self.conn.execute("SELECT f.path, h.offset, h.length FROM hands h "
+                                "JOIN files f ON f.id = h.file_id WHERE h.hand_no = ?",
+                                (hand_no,)).fetchone()
+        if row is None:
+            raise KeyError(hand_no)
+        path, offset, length = row
+        with pokerstars_parser.open_hhfile(path) as f:
+            encoding = pokerstars_parser.detect_encoding(f)
+            f.seek(offset)
+            return pokerstars_parser.decode_hand(f.read(length), encoding)
+
+    def fetch(self, hand_no, parser='regex'):
+        return pokerstars_parser.PARSERS[parser](self.fetch_text(hand_no))
+
+    def close(self):
+        self.commit()
+        self.conn.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
@@ -0,0 +1,201 @@
+"""Weighted ranges of 2-card holdings, hand classes and range notation."""
+import functools
+import itertools
+import numpy as np
+
+RANKS = '23456789TJQKA'
+SUITS = 'cdhs'
+
+
+def mask_cards(mask):
+    """Codes of the cards in mask."""
+    return [i for i in range(52) if (mask >> i) & 1]
+
+
+class Range:
+    """A weighted range of holdings, as parallel arrays of masks and weights.
+
+    The combos holding each card are indexed on the first live() call, so
+    removing the combos blocked by a hero/board mask touches only those
+    combos instead of scanning the whole range.
+
+        r = Range([strhand_to_mask('AhAs'), strhand_to_mask('KhKs')], [1., .5])
+        masks, weights = r.live(board_mask)
+    """
+
+    def __init__(self, masks, weights=None):
+        self.masks = np.asarray(masks, dtype=np.int64).reshape(-1)
+        if weights is None:
+            self.weights = np.ones(len(self.masks))
+        else:
+            self.weights = np.asarray(weights, dtype=np.float64).reshape(-1)
+            if len(self.weights) != len(self.masks):
+                raise ValueError("Got {} weights for {} combos".format(
+                    len(self.weights), len(self.masks)))
+        self._by_card = None
+
+    def __len__(self):
+        return len(self.masks)
+
+    def __repr__(self):
+        return "Range({} combos, weight {:g})".format(len(self), self.weights.sum())
+
+    @property
+    def by_card(self):
+        """Indices of the combos that hold each card."""
+        if self._by_card is None:
+            self._by_card = [np.flatnonzero((self.masks >> c) & 1) for c in range(52)]
+        return self._by_card
+
+    def live_index(self, dead_mask):
+        """Boolean array of the combos that don't hold any card of dead_mask."""
+        live = np.ones(len(self.masks), dtype=bool)
+        for c in mask_cards(dead_mask):
+            live[self.by_card[c]] = False
+        return live
+
+    def live(self, dead_mask):
+        """(masks, weights) of the combos that don't hold any card of dead_mask."""
+        live = self.live_index(dead_mask)
+        return self.masks[live], self.weights[live]
+
+
+def as_range(hrange):
+    """hrange as a Range; plain lists of masks get unit weights."""
+    if isinstance(hrange, Range):
+        return hrange
+    return Range(hrange)
+
+def live_range(hrange, dead_mask):
+    """(masks, weights) of the live combos of a Range or a plain list of
+    masks; a list is filtered in one pass, with unit weights."""
+    if isinstance(hrange, Range):
+        return hrange.live(dead_mask)
+    masks = np.asarray(hrange, dtype=np.int64).reshape(-1)
+    masks = masks[(masks & dead_mask) == 0]
+    return masks, np.ones(len(masks))
+
+
+# the 1326 combos in itertools.combinations(range(52), 2) order
+COMBO_CARDS = np.array(list(itertools.combinations(range(52), 2)), dtype=np.int64)
+COMBO_MASKS = (1 << COMBO_CARDS[:, 0]) | (1 << COMBO_CARDS[:, 1])
+COMBO_INDEX = {int(m): i for i, m in enumerate(COMBO_MASKS)}
+
+def _make_classes():
+    # the 13x13 grid from AA: pairs on the diagonal, suited hands above it
+    # and offsuit hands below
+    names = []
+    index = {}
+    for i, hi in enumerate(reversed(RANKS)):
+        for j, lo in enumerate(reversed(RANKS)):
+            if i == j:
+                key = (hi, hi, '')
+            elif j > i:
+                key = (hi, lo, 's')
+            else:
+                key = (lo, hi, 'o')
+            index[key] = len(names)
+            names.append(''.join(key))
+    ranks = COMBO_CARDS % 13
+    suited = COMBO_CARDS[:, 0] // 13 == COMBO_CARDS[:, 1] // 13
+    combo_class = np.zeros(len(COMBO_MASKS), dtype=np.int16)
+    for n, (r1, r2) in enumerate(ranks):
+        hi, lo = RANKS[max(r1, r2)], RANKS[min(r1, r2)]
+        kind = '' if hi == lo else ('s' if suited[n] else 'o')
+        combo_class[n] = index[(hi, lo, kind)]
+    class_combos = []
+    for c in range(len(names)):
+        masks = COMBO_MASKS[combo_class == c]
+        masks.setflags(write=False)
+        class_combos.append(masks)
+    combo_class.setflags(write=False)
+    return names, index, combo_class, class_combos
+
+HAND_CLASSES, CLASS_INDEX, COMBO_CLASS, CLASS_COMBOS = _make_classes()
+
+def hand_class(mask):
+    """Index in HAND_CLASSES of the class of a 2-card mask."""
+    return int(COMBO_CLASS[COMBO_INDEX[int(mask)]])
+
+def class_combos(mask):
+    """Read-only array of the combo masks of the class of a 2-card mask."""
+    return CLASS_COMBOS[hand_class(mask)]
+
+def _class_spec(token):
+    """(high, low, kind) of a class token such as 'AKs', 'AK' or 'TT'."""
+    if len(token) not in (2, 3) or token[0] not in RANKS or token[1] not in RANKS:
+        raise ValueError("Bad hand class: {}".format(token))
+    hi, lo = sorted(token[:2], key=RANKS.index, reverse=True)
+    kind = token[2:]
+    if kind not in ('', 's', 'o') or (hi == lo and kind):
+        raise ValueError("Bad hand class: {}".format(token))
+    return hi, lo, kind
+
+def _class_keys(hi, lo, kind):
+    if hi == lo:
+        return [(hi, lo, '')]
+    return [(hi, lo, k) for k in (kind or 'so')]
+
+def _token_classes(token):
+    """Class indices of a range notation token (no specific combos)."""
+    if '-' in token:
+        a, b = (_class_spec(t) for t in token.split('-'))
+        if a[2] != b[2] or (a[0] == a[1]) != (b[0] == b[1]) or \
+                (a[0] != a[1] and a[0] != b[0]):
+            raise ValueError("Bad range: {}".format(token))
+        if a[0] == a[1]:
+            # 22-55
+            r1, r2 = sorted([RANKS.index(a[0]), RANKS.index(b[0])])
+            specs = [(RANKS[r], RANKS[r], '') for r in range(r1, r2 + 1)]
+        else:
+            # A2s-A5s
+            r1, r2 = sorted([RANKS.index(a[1]), RANKS.index(b[1])])
+            specs = [(a[0], RANKS[r], a[2]) for r in range(r1, r2 + 1)]
+    elif token.endswith('+'):
+        hi, lo, kind = _class_spec(token[:-1])
+        if hi == lo:
+            # TT+
+            specs = [(RANKS[r], RANKS[r], '') for r in range(RANKS.index(hi), 13)]
+        else:
+            # AJs+: the kicker goes up to just below the high card
+            specs = [(hi, RANKS[r], kind) for r in range(RANKS.index(lo), RANKS.index(hi))]
+    else:
+        specs = [_class_spec(token)]
+    return [CLASS_INDEX[key] for spec in specs for key in _class_keys(*spec)]
+
+@functools.lru_cache(maxsize=4096)
+def parse_range(s):
+    """Combo masks of a range in the usual notation, e.g. "TT+, AJs+, KQo,
+    A2s-A5s, AhKh", as a read-only int64 array in combo order.
+
+    Results are cached, so parsing the same string again allocates nothing.
+    """
+    indices = []
+    for token in s.replace(' ', '').split(','):
+        if not token:
+            continue
+        if len(token) == 4 and token[1] in SUITS and token[3] in SUITS:
+            # a specific combo
+            try:
+                cards = [RANKS.index(token[i]) + 13 * SUITS.index(token[i+1]) for i in (0, 2)]
+                indices.append(COMBO_INDEX[(1 << cards[0]) | (1 << cards[1])])
+            except (ValueError, KeyError):
+                raise ValueError("Bad combo: {}".format(token))
+        else:
+            for c in _token_classes(token):
+                indices.extend(np.flatnonzero(COMBO_CLASS == c))
+    masks = COMBO_MASKS[np.unique(np.array(indices, dtype=np.intp))]
+    masks.setflags(write=False)
+    return masks
+
+def combo_weights(hrange):
+    """Weights of a range by combo index (COMBO_MASKS order), 0 for the
+    combos it doesn't hold. hrange is a Range, a list of masks or range
+    notation."""
+    if isinstance(hrange, str):
+        hrange = parse_range(hrange)
+    hrange = as_range(hrange)
+    weights = np.zeros(len(COMBO_MASKS))
+    index = np.array([COMBO_INDEX[int(m)] for m in hrange.masks], dtype=np.intp)
+    np.add.at(weights, index, hrange.weights)
+    return weights
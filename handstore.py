@@ -0,0 +1,267 @@
+import os
+import json
+import numpy as np
+import pandas as pd
+
+try:
+    import pyarrow
+    import pyarrow.parquet
+except ImportError:
+    pyarrow = None
+
+STREETS = ['preflop', 'flop', 'turn', 'river']
+LAST_STREET_CODE = {'preflop': 0, 'flop': 1, 'turn': 2, 'river': 3, 'showdown': 4}
+
+# column name -> dtype for every table of the store
+SCHEMA = {
+    'hands': [
+        ('hand_no', np.int64),
+        ('table', np.int32),
+        ('timestamp', np.int64),  # ns since epoch, UTC
+        ('sb', np.float64),
+        ('bb', np.float64),
+        ('ante', np.float64),
+        ('totalpot', np.float64),
+        ('rake', np.float64),
+        ('nplayers', np.int8),
+        ('hero', np.int32),  # -1 when there is no hero
+        ('last_street', np.int8),
+        ('board', 'S10'),
+        ('uncalled_amt', np.float64),
+        ('uncalled_player', np.int32),  # -1 when no bet was returned
+    ],
+    'actions': [
+        ('hand_no', np.int64),
+        ('street', np.int8),
+        ('seq', np.int16),
+        ('player', np.int32),
+        ('action', np.int16),
+        ('amount', np.float64),  # NaN for actions without an amount
+        ('pot', np.float64),
+        ('himark', np.float64),
+    ],
+    'players': [
+        ('hand_no', np.int64),
+        ('player', np.int32),
+        ('seat', np.int8),
+        ('position', np.int16),
+        ('stack', np.float64),
+        ('post', np.float64),
+        ('inv_preflop', np.float64),
+        ('inv_flop', np.float64),
+        ('inv_turn', np.float64),
+        ('inv_river', np.float64),
+        ('inv_total', np.float64),
+        ('won', np.float64),
+        ('rake_contrib', np.float64),
+        ('holecards', 'S4'),
+    ],
+}
+# string columns are interned to integer ids, one vocabulary per kind
+VOCABS = ['players', 'tables', 'actions', 'positions']
+
+
+class HandBuffer:
+    """Parsed hands as typed columns in memory, in the layout of SCHEMA.
+
+    Player names, table names, actions and positions are interned to
+    integer ids; names(kind) lists the names of the ids of a kind.
+    """
+
+    def __init__(self, vocabs=None):
+        if vocabs is None:
+            vocabs = {kind: {} for kind in VOCABS}
+        self.vocabs = vocabs
+        self._reset()
+
+    def _reset(self):
+        self.buf = {table: {col: [] for col, _ in cols} for table, cols in SCHEMA.items()}
+        self.nbuffered = 0
+
+    def intern(self, kind, name):
+        vocab = self.vocabs[kind]
+        if name not in vocab:
+            vocab[name] = len(vocab)
+        return vocab[name]
+
+    def names(self, kind):
+        vocab = self.vocabs[kind]
+        return sorted(vocab, key=vocab.get)
+
+    def add(self, d):
+        hands = self.buf['hands']
+        hand_no = d['hand_no']
+        hands['hand_no'].append(hand_no)
+        hands['table'].append(self.intern('tables', d['table_name']))
+        hands['timestamp'].append(pd.Timestamp(d['timestamp']).value)
+        for col in ['sb', 'bb', 'ante', 'totalpot', 'rake']:
+            hands[col].append(d[col])
+        hands['nplayers'].append(len(d['sd_dict']))
+        hands['hero'].append(-1 if d['hero'] is None else self.intern('players', d['hero']))
+        hands['last_street'].append(LAST_STREET_CODE[d['last_street']])
+        hands['board'].append(d['board'] or '')
+        ucb = d['uncalled_bet']
+        hands['uncalled_amt'].append(ucb[0] if ucb else 0.)
+        hands['uncalled_player'].append(self.intern('players', ucb[1]) if ucb else -1)
+
+        actions = self.buf['actions']
+        for street_code, street in enumerate(STREETS):
+            for seq, (name, action, amt, pot_now, himark) in \
+                    enumerate(d['act_dict'].get(street, [])):
+                actions['hand_no'].append(hand_no)
+                actions['street'].append(street_code)
+                actions['seq'].append(seq)
+                actions['player'].append(self.intern('players', name))
+                actions['action'].append(self.intern('actions', action))
+                actions['amount'].append(np.nan if amt is None else amt)
+                actions['pot'].append(pot_now)
+                actions['himark'].append(himark)
+
+        players = self.buf['players']
+        minv = d['minv']
+        won = {}
+        for name, amt in d['winners']:
+            won[name] = won.get(name, 0) + amt
+        for seat, name in d['sd_dict'].items():
+            players['hand_no'].append(hand_no)
+            players['player'].append(self.intern('players', name))
+            players['seat'].append(seat)
+            players['position'].append(self.intern('positions', d['relpos_dict'][name]))
+            players['stack'].append(d['stacks'][name])
+            players['post'].append(d['post_dict'][name])
+            for street in STREETS + ['total']:
+                players['inv_' + street].append(minv.get(street, {}).get(name, 0.))
+            players['won'].append(won.get(name, 0.))
+            players['rake_contrib'].append(d['rake_contrib'].get(name, 0.))
+            players['holecards'].append(d['holecards'].get(name, ''))
+
+        self.nbuffered += 1
+
+    def extend(self, hands):
+        for d in hands:
+            self.add(d)
+
+    def arrays(self):
+        """The buffered hands as {table: {column: array}}."""
+        return {table: {col: np.array(self.buf[table][col], dtype=dtype) for col, dtype in cols}
+                for table, cols in SCHEMA.items()}
+
+
+class HandStore(HandBuffer):
+    """Streams parsed hands into chunked, typed column files on disk.
+
+    Hands are buffered in plain lists and written out every chunk_size hands
+    as one .npy file per column (or one .parquet file per table when
+    fmt='parquet' and pyarrow is available), so memory stays bounded by a
+    single chunk. Player names, table names, actions and positions are
+    interned to integer ids. Opening an existing store appends to it.
+
+        with HandStore('store') as store:
+            parse_directory('hh', sink=store)
+    """
+
+    def __init__(self, path, chunk_size=100000, fmt='npy'):
+        if fmt == 'parquet' and pyarrow is None:
+            raise ImportError("pyarrow is required for fmt='parquet'")
+        self.path = path
+        self.chunk_size = chunk_size
+        self.fmt = fmt
+        os.makedirs(path, exist_ok=True)
+        vocabs = {}
+        for kind in VOCABS:
+            names = load_vocab(path, kind)
+            vocabs[kind] = {name: i for i, name in enumerate(names)}
+        super().__init__(vocabs)
+        self.nchunks = len(list_chunks(path, 'hands'))
+
+    def add(self, d):
+        super().add(d)
+        if self.nbuffered >= self.chunk_size:
+            self.flush()
+
+    def flush(self):
+        if not self.nbuffered:
+            return
+        chunk = '{:06d}'.format(self.nchunks)
+        for table, arrays in self.arrays().items():
+            tabledir = os.path.join(self.path, table)
+            os.makedirs(tabledir, exist_ok=True)
+            if self.fmt == 'parquet':
+                pyarrow.parquet.write_table(pyarrow.table(arrays),
+                                            os.path.join(tabledir, chunk + '.parquet'))
+            else:
+                chunkdir = os.path.join(tabledir, chunk)
+                os.makedirs(chunkdir, exist_ok=True)
+                for col, arr in arrays.items():
+                    np.save(os.path.join(chunkdir, col + '.npy'), arr)
+        self.nchunks += 1
+        self._reset()
+        self.save_vocabs()
+
+    def save_vocabs(self):
+        for kind, vocab in self.vocabs.items():
+            names = self.names(kind)
+            tmpfn = os.path.join(self.path, kind + '.json.tmp')
+            with open(tmpfn, 'w') as f:
+                json.dump(names, f)
+            os.replace(tmpfn, os.path.join(self.path, kind + '.json'))
+
+    def close(self):
+        self.flush()
+        self.save_vocabs()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+
+def load_vocab(path, kind):
+    """Returns the list of names of an interned column; ids index into it."""
+    fn = os.path.join(path, kind + '.json')
+    if not os.path.exists(fn):
+        return []
+    with open(fn) as f:
+        return json.load(f)
+
+def list_chunks(path, table):
+    tabledir = os.path.join(path, table)
+    if not os.path.isdir(tabledir):
+        return []
+    return sorted(os.path.join(tabledir, x) for x in os.listdir(tabledir))
+
+def iter_chunks(path, table, columns=None):
+    """Yields every chunk of a table as a dict of column arrays.
+
+    .npy chunks are memory-mapped, so nothing is copied until the arrays
+    are actually used.
+    """
+    if columns is None:
+        columns = [col for col, _ in SCHEMA[table]]
+    for chunk in list_chunks(path, table):
+        if chunk.endswith('.parquet'):
+            t = pyarrow.parquet.read_table(chunk, columns=columns)
+            yield {col: t.column(col).to_numpy() for col in columns}
+        else:
+            yield {col: np.load(os.path.join(chunk, col + '.npy'), mmap_mode='r')
+                   for col in columns}
+
+def load_table(path, table, columns=None):
+    """Loads a whole table as a dict of column arrays.
+
+    A single-chunk table is returned memory-mapped; several chunks are
+    concatenated into memory.
+    """
+    if columns is None:
+        columns = [col for col, _ in SCHEMA[table]]
+    chunks = list(iter_chunks(path, table, columns))
+    if len(chunks) == 1:
+        return chunks[0]
+    if not chunks:
+        return {col: np.array([], dtype=dtype) for col, dtype in SCHEMA[table]
+                if col in columns}
+    return {col: np.concatenate([c[col] for c in chunks]) for col in columns}
+
+def load_frame(path, table, columns=None):
+    return pd.DataFrame(load_table(path, table, columns), copy=False)
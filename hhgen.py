@@ -0,0 +1,428 @@
+"""Synthetic PokerStars hand histories for tests and benchmarks.
+
+The hands follow the layout parse_hand expects: No Limit Hold'em cash
+games with 2-9 players, optional antes, dead blinds, chat and connection
+noise, uncalled bets, all-ins with side pots and showdowns. Betting is
+random but the accounting is exact, so every generated hand parses.
+"""
+import os
+import random
+import datetime
+
+RANKS = '23456789TJQKA'
+SUITS = 'cdhs'
+DECK = [r + s for r in RANKS for s in SUITS]
+RANK_NAMES = ['Deuces', 'Threes', 'Fours', 'Fives', 'Sixes', 'Sevens', 'Eights',
+              'Nines', 'Tens', 'Jacks', 'Queens', 'Kings', 'Aces']
+HIGH_NAMES = ['Deuce', 'Three', 'Four', 'Five', 'Six', 'Seven', 'Eight', 'Nine',
+              'Ten', 'Jack', 'Queen', 'King', 'Ace']
+TABLE_NAMES = ['Acamar', 'Achernar', 'Adhara', 'Alcor', 'Algenib', 'Alkaid',
+               'Alnair', 'Alphard', 'Ankaa', 'Antares', 'Bellatrix', 'Canopus']
+STAKES = [(2, 5), (5, 10), (10, 25), (25, 50), (50, 100), (100, 200)]
+CHAT = ['gl', 'nh', 'ty', 'lol', 'wp', 'unreal', 'fold pls', 'ship it']
+
+
+def fmt(cents):
+    if cents % 100 == 0:
+        return '${}'.format(cents // 100)
+    return '${}.{:02d}'.format(cents // 100, cents % 100)
+
+def hand_value(cards):
+    """Comparable value of the best 5-card high hand out of cards, with a
+    short description."""
+    ranks = sorted((RANKS.index(c[0]) for c in cards), reverse=True)
+    counts = {}
+    for r in ranks:
+        counts[r] = counts.get(r, 0) + 1
+    groups = sorted(counts.items(), key=lambda x: (x[1], x[0]), reverse=True)
+    bysuit = {}
+    for c in cards:
+        bysuit.setdefault(c[1], []).append(RANKS.index(c[0]))
+    flush = [sorted(v, reverse=True) for v in bysuit.values() if len(v) >= 5]
+
+    def straight_high(rs):
+        rs = set(rs)
+        if 12 in rs:
+            rs.add(-1)
+        for top in range(12, 2, -1):
+            if all(r in rs for r in range(top - 4, top + 1)):
+                return top
+        return None
+
+    if flush:
+        sf = straight_high(flush[0])
+        if sf is not None:
+            return (8, sf), 'a straight flush, {} to {}'.format(
+                HIGH_NAMES[sf - 4] if sf > 3 else 'Ace', HIGH_NAMES[sf])
+    if groups[0][1] == 4:
+        kick = max(r for r in ranks if r != groups[0][0])
+        return (7, groups[0][0], kick), 'four of a kind, {}'.format(RANK_NAMES[groups[0][0]])
+    if groups[0][1] == 3 and groups[1][1] >= 2:
+        return (6, groups[0][0], groups[1][0]), 'a full house, {} full of {}'.format(
+            RANK_NAMES[groups[0][0]], RANK_NAMES[groups[1][0]])
+    if flush:
+        return (5,) + tuple(flush[0][:5]), 'a flush, {} high'.format(HIGH_NAMES[flush[0][0]])
+    st = straight_high(ranks)
+    if st is not None:
+        return (4, st), 'a straight, {} to {}'.format(
+            HIGH_NAMES[st - 4] if st > 3 else 'Ace', HIGH_NAMES[st])
+    if groups[0][1] == 3:
+        kick = [r for r in ranks if r != groups[0][0]][:2]
+        return (3, groups[0][0]) + tuple(kick), 'three of a kind, {}'.format(
+            RANK_NAMES[groups[0][0]])
+    if groups[0][1] == 2 and groups[1][1] == 2:
+        hi, lo = groups[0][0], groups[1][0]
+        kick = max(r for r in ranks if r not in (hi, lo))
+        return (2, hi, lo, kick), 'two pair, {} and {}'.format(RANK_NAMES[hi], RANK_NAMES[lo])
+    if groups[0][1] == 2:
+        kick = [r for r in ranks if r != groups[0][0]][:3]
+        return (1, groups[0][0]) + tuple(kick), 'a pair of {}'.format(RANK_NAMES[groups[0][0]])
+    return (0,) + tuple(ranks[:5]), 'high card {}'.format(HIGH_NAMES[ranks[0]])
+
+
+class _Player:
+    def __init__(self, seat, name, stack):
+        self.seat = seat
+        self.name = name
+        self.stack = stack  # cents behind
+        self.street = 0  # live money put in on the current street
+        self.total = 0  # everything put in the pot, including dead money
+        self.folded = False
+        self.allin = False
+        self.cards = None
+        self.fold_street = None
+        self.sitting_out = False
+
+
+def generate_hand(rng, hand_no, timestamp, table, maxseats=9, nplayers=None,
+                  stakes=None, ante=0, noise=0.05, hero=True):
+    """Returns the text of one synthetic hand (with the trailing blank lines).
+
+    rng is a random.Random, ante is in cents and noise is the probability
+    of chat/connection lines between actions.
+    """
+    if stakes is None:
+        stakes = rng.choice(STAKES)
+    sb, bb = stakes
+    if nplayers is None:
+        nplayers = rng.randint(2, maxseats)
+    seats = sorted(rng.sample(range(1, maxseats + 1), nplayers))
+    players = []
+    for seat in seats:
+        name = 'player{}_{}'.format(seat, rng.randint(0, 20))
+        stack = rng.randint(20 * bb, 250 * bb)
+        players.append(_Player(seat, name, stack))
+    btn_i = rng.randrange(nplayers)
+    btn = players[btn_i]
+    if nplayers == 2:
+        sbp, bbp = btn, players[(btn_i + 1) % nplayers]
+    else:
+        sbp, bbp = players[(btn_i + 1) % nplayers], players[(btn_i + 2) % nplayers]
+    # without antes an occasional player between the big blind and the
+    # button sits out of the hand
+    if not ante and nplayers > 4 and rng.random() < 0.1:
+        first = (players.index(bbp) + 1) % nplayers
+        candidates = [players[(first + k) % nplayers] for k in range(nplayers - 3)]
+        rng.choice(candidates).sitting_out = True
+    active = [p for p in players if not p.sitting_out]
+    nact = len(active)
+    btn_i = active.index(btn)
+    # order of action preflop and postflop
+    first_pre = (active.index(bbp) + 1) % nact
+    pre_order = [active[(first_pre + k) % nact] for k in range(nact)]
+    first_post = (btn_i + 1) % nact
+    post_order = [active[(first_post + k) % nact] for k in range(nact)]
+
+    deck = DECK[:]
+    rng.shuffle(deck)
+    for p in active:
+        p.cards = [deck.pop(), deck.pop()]
+    board = [deck.pop() for _ in range(5)]
+    heroplayer = rng.choice(active) if hero else None
+
+    out = []
+    ts = timestamp.strftime('%Y/%m/%d %H:%M:%S')
+    out.append("PokerStars Hand #{}:  Hold'em No Limit ({}/{} USD) - {}".format(
+        hand_no, fmt(sb), fmt(bb), ts))
+    out.append("Table '{}' {}-max Seat #{} is the button".format(table, maxseats, btn.seat))
+    for p in players:
+        line = "Seat {}: {} ({} in chips)".format(p.seat, p.name, fmt(p.stack))
+        if p.sitting_out:
+            line += " is sitting out"
+        out.append(line)
+
+    def put(p, amt, live=True):
+        p.stack -= amt
+        p.total += amt
+        if live:
+            p.street += amt
+        if p.stack == 0:
+            p.allin = True
+
+    if ante:
+        for p in active:
+            put(p, ante, live=False)
+            out.append("{}: posts the ante {}".format(p.name, fmt(ante)))
+    put(sbp, sb)
+    out.append("{}: posts small blind {}".format(sbp.name, fmt(sb)))
+    put(bbp, bb)
+    out.append("{}: posts big blind {}".format(bbp.name, fmt(bb)))
+    # dead blinds from players coming back in late position
+    for p in active:
+        if p in (sbp, bbp, btn) or nact < 4 or rng.random() > 0.04:
+            continue
+        if rng.random() < 0.5:
+            put(p, sb, live=False)
+            put(p, bb)
+            out.append("{}: posts small & big blinds {}".format(p.name, fmt(sb + bb)))
+        else:
+            put(p, bb)
+            out.append("{}: posts big blind {}".format(p.name, fmt(bb)))
+
+    def noise_line(p):
+        r = rng.random()
+        if r < 0.4:
+            return '{} said, "{}"'.format(p.name, rng.choice(CHAT))
+        if r < 0.6:
+            return '{} is disconnected '.format(p.name)
+        if r < 0.8:
+            return '{} is connected '.format(p.name)
+        if r < 0.9:
+            return 'guest{} joins the table at seat #{}'.format(rng.randint(0, 99), rng.randint(1, 9))
+        return '{} has timed out'.format(p.name)
+
+    def betting_round(order, himark, minraise, street):
+        """Plays a street; returns the uncalled (player, amount) or None."""
+        lines = []
+        last_aggr = None
+        acted = set()
+        nraises = 0
+        while True:
+            live = [p for p in order if not p.folded]
+            if len(live) == 1:
+                break
+            pending = [p for p in order if not p.folded and not p.allin
+                       and (p not in acted or p.street < himark)]
+            if not pending:
+                break
+            # next player in order after the last actor
+            p = pending[0]
+            if rng.random() < noise:
+                lines.append(noise_line(p))
+            to_call = himark - p.street
+            others = [q for q in live if q is not p and not q.allin]
+            r = rng.random()
+            if to_call > 0:
+                if r < 0.35:
+                    p.folded = True
+                    p.fold_street = street
+                    lines.append("{}: folds".format(p.name))
+                elif r < 0.85 or nraises >= 4 or not others or p.stack <= to_call:
+                    amt = min(to_call, p.stack)
+                    put(p, amt)
+                    lines.append("{}: calls {}{}".format(
+                        p.name, fmt(amt), " and is all-in" if p.allin else ""))
+                else:
+                    target = himark + max(minraise, rng.choice([1, 1, 2, 3]) * max(minraise, himark))
+                    if rng.random() < 0.1:
+                        target = p.street + p.stack
+                    target = min(target, p.street + p.stack)
+                    inc = target - himark
+                    put(p, target - p.street)
+                    lines.append("{}: raises {} to {}{}".format(
+                        p.name, fmt(inc), fmt(target), " and is all-in" if p.allin else ""))
+                    if inc >= minraise:
+                        minraise = inc
+                    himark = target
+                    last_aggr = p
+                    nraises += 1
+                    acted = set()
+            else:
+                if r < 0.6 or not others:
+                    lines.append("{}: checks".format(p.name))
+                else:
+                    amt = rng.choice([0.5, 0.66, 0.75, 1.0]) * pot() if street > 0 else minraise
+                    amt = max(int(amt), bb)
+                    if rng.random() < 0.08:
+                        amt = p.stack
+                    amt = min(amt, p.stack)
+                    if himark == 0:
+                        put(p, amt)
+                        lines.append("{}: bets {}{}".format(
+                            p.name, fmt(amt), " and is all-in" if p.allin else ""))
+                        minraise = max(amt, bb)
+                        himark = amt
+                    else:
+                        # the big blind option preflop
+                        target = himark + amt
+                        target = min(target, p.street + p.stack)
+                        inc = target - himark
+                        put(p, target - p.street)
+                        lines.append("{}: raises {} to {}{}".format(
+                            p.name, fmt(inc), fmt(target), " and is all-in" if p.allin else ""))
+                        minraise = max(inc, minraise)
+                        himark = target
+                    last_aggr = p
+                    nraises += 1
+                    acted = set()
+            acted.add(p)
+            # rotate the order so that action continues after p
+            i = order.index(p)
+            order = order[i + 1:] + order[:i + 1]
+        uncalled = None
+        if last_aggr is not None or street == 0:
+            top = max(order, key=lambda q: q.street)
+            second = max([q.street for q in order if q is not top] or [0])
+            if top.street > second:
+                amt = top.street - second
+                top.stack += amt
+                top.total -= amt
+                top.street -= amt
+                top.allin = top.stack == 0
+                uncalled = (top, amt)
+                lines.append("Uncalled bet ({}) returned to {}".format(fmt(amt), top.name))
+        return lines, uncalled
+
+    def pot():
+        return sum(p.total for p in players)
+
+    out.append("*** HOLE CARDS ***")
+    if heroplayer is not None:
+        out.append("Dealt to {} [{} {}]".format(heroplayer.name, *heroplayer.cards))
+    lines, uncalled = betting_round(pre_order, bb, bb, 0)
+    out.extend(lines)
+    street_names = ['FLOP', 'TURN', 'RIVER']
+    nboard = 0
+    for street in range(1, 4):
+        live = [p for p in active if not p.folded]
+        if len(live) < 2:
+            break
+        ncards = 3 if street == 1 else 1
+        for p in active:
+            p.street = 0
+        if street == 1:
+            out.append("*** FLOP *** [{}]".format(" ".join(board[:3])))
+        else:
+            out.append("*** {} *** [{}] [{}]".format(
+                street_names[street - 1], " ".join(board[:nboard]), board[nboard]))
+        nboard += ncards
+        if len([p for p in live if not p.allin]) >= 2:
+            lines, uncalled = betting_round(post_order, 0, bb, street)
+            out.extend(lines)
+    live = [p for p in active if not p.folded]
+    total = pot()
+    rake = 0
+    if nboard:
+        rake = min(total * 5 // 100, 300)
+    # split the pot into main and side pots, levels by total investment
+    winnings = {}
+    pots = []
+    if len(live) == 1:
+        pots.append((total, [live[0]]))
+    else:
+        levels = sorted(set(p.total for p in live))
+        prev = 0
+        for lvl in levels:
+            amt = sum(min(p.total, lvl) - min(p.total, prev) for p in players)
+            eligible = [p for p in live if p.total >= lvl]
+            if amt:
+                pots.append((amt, eligible))
+            prev = lvl
+        leftover = total - sum(a for a, _ in pots)
+        if leftover:
+            pots[-1] = (pots[-1][0] + leftover, pots[-1][1])
+    values = {p.name: hand_value(p.cards + board) for p in live} if len(live) > 1 else {}
+    for i, (amt, eligible) in enumerate(pots):
+        if i == 0:
+            amt -= rake
+        if len(eligible) == 1:
+            winners = eligible
+        else:
+            best = max(values[p.name][0] for p in eligible)
+            winners = [p for p in eligible if values[p.name][0] == best]
+        share = amt // len(winners)
+        for k, p in enumerate(winners):
+            extra = amt - share * len(winners) if k == 0 else 0
+            winnings[p.name] = winnings.get(p.name, 0) + share + extra
+    if len(live) > 1:
+        out.append("*** SHOW DOWN ***")
+        for p in live:
+            out.append("{}: shows [{} {}] ({})".format(p.name, p.cards[0], p.cards[1],
+                                                      values[p.name][1]))
+        for p in live:
+            if p.name in winnings:
+                out.append("{} collected {} from pot".format(p.name, fmt(winnings[p.name])))
+    else:
+        w = live[0]
+        out.append("{} collected {} from pot".format(w.name, fmt(winnings[w.name])))
+        if rng.random() < 0.5:
+            out.append("{}: doesn't show hand ".format(w.name))
+    out.append("*** SUMMARY ***")
+    if len(pots) > 1:
+        side = " ".join("Side pot-{} {}.".format(i, fmt(a)) for i, (a, _) in enumerate(pots[1:], 1))
+        out.append("Total pot {} Main pot {}. {} | Rake {}".format(
+            fmt(total), fmt(pots[0][0]), side, fmt(rake)))
+    else:
+        out.append("Total pot {} | Rake {}".format(fmt(total), fmt(rake)))
+    if nboard:
+        out.append("Board [{}]".format(" ".join(board[:nboard])))
+    street_words = ['before Flop', 'on the Flop', 'on the Turn', 'on the River']
+    for p in active:
+        tags = ""
+        if p is btn:
+            tags += " (button)"
+        if p is sbp:
+            tags += " (small blind)"
+        elif p is bbp:
+            tags += " (big blind)"
+        if p.folded:
+            extra = " (didn't bet)" if p.fold_street == 0 and p.total == 0 else ""
+            line = "Seat {}: {}{} folded {}{}".format(p.seat, p.name, tags,
+                                                      street_words[p.fold_street], extra)
+        elif len(live) == 1:
+            line = "Seat {}: {}{} collected ({})".format(p.seat, p.name, tags, fmt(winnings[p.name]))
+        elif p.name in winnings:
+            line = "Seat {}: {}{} showed [{} {}] and won ({}) with {}".format(
+                p.seat, p.name, tags, p.cards[0], p.cards[1], fmt(winnings[p.name]),
+                values[p.name][1])
+        else:
+            line = "Seat {}: {}{} showed [{} {}] and lost with {}".format(
+                p.seat, p.name, tags, p.cards[0], p.cards[1], values[p.name][1])
+        out.append(line)
+    return "\n".join(out) + "\n\n\n\n"
+
+
+def generate_file(fn, nhands, seed=0, maxseats=None, ante_prob=0.1, noise=0.05,
+                  start=None, first_hand_no=100000000000):
+    """Writes nhands synthetic hands at one table to fn."""
+    rng = random.Random(seed)
+    if maxseats is None:
+        maxseats = rng.choice([2, 6, 9])
+    if start is None:
+        start = datetime.datetime(2016, 1, 4, 12, 0, 0)
+    table = '{} {}'.format(rng.choice(TABLE_NAMES), rng.choice(['I', 'II', 'III', 'IV', 'V']))
+    stakes = rng.choice(STAKES)
+    ante = stakes[0] // 5 if rng.random() < ante_prob else 0
+    ts = start
+    with open(fn, 'w') as f:
+        for i in range(nhands):
+            nplayers = rng.randint(2, maxseats)
+            f.write(generate_hand(rng, first_hand_no + i, ts, table, maxseats,
+                                  nplayers, stakes, ante, noise))
+            ts += datetime.timedelta(seconds=rng.randint(20, 90))
+
+def generate_directory(directory, nhands, hands_per_file=500, seed=0, **kwargs):
+    """Writes nhands synthetic hands to a tree of .txt files under directory
+    and returns the list of files written."""
+    fns = []
+    nfiles = (nhands + hands_per_file - 1) // hands_per_file
+    for i in range(nfiles):
+        sub = os.path.join(directory, '{:04d}'.format(i // 100))
+        os.makedirs(sub, exist_ok=True)
+        fn = os.path.join(sub, 'HH{:06d}.txt'.format(i))
+        n = min(hands_per_file, nhands - i * hands_per_file)
+        start = datetime.datetime(2016, 1, 4, 12, 0, 0) + datetime.timedelta(hours=6 * i)
+        generate_file(fn, n, seed=seed * 1000003 + i, start=start,
+                      first_hand_no=100000000000 + i * hands_per_file, **kwargs)
+        fns.append(fn)
+    return fns
@@ -0,0 +1,274 @@
+"""Opt-in timers and counters for the parser and evaluator hot paths.
+
+    instrument.enable()
+    res, errcounts, skipped, report = parse_directory('hh', report=True)
+    instrument.export_metrics('metrics.jsonl', report)
+
+enable() wraps the instrumented functions (STAGES) in their modules and
+disable() puts the originals back, so while disabled nothing is measured
+and the hot paths run unchanged. Times are inclusive (parse_hand includes
+its parse_street calls) and, with workers, summed over the worker
+processes.
+"""
+import sys
+import json
+import time
+import functools
+import importlib
+
+# (module, function, stage name) of every timed function; the evaluator
+# functions are looked up through peval, which falls back to peval_np
+# without the compiled peval_ex
+STAGES = [
+    ('azpoker.pokerstars_parser', 'iter_raw_hands', 'split'),
+    ('azpoker.pokerstars_parser', 'decode_hand', 'decode'),
+    ('azpoker.pokerstars_parser', 'parse_header', 'parse_header'),
+    ('azpoker.pokerstars_parser', 'parse_header_sm', 'parse_header'),
+    ('azpoker.pokerstars_parser', 'parse_timestamp', 'parse_timestamp'),
+    ('azpoker.pokerstars_parser', 'parse_street', 'parse_street'),
+    ('azpoker.pokerstars_parser', 'parse_street_lines', 'parse_street'),
+    ('azpoker.peval', 'evaluate_values', 'evaluate_values'),
+    ('azpoker.peval', 'peval_ex.evaluate_high', 'evaluate_high'),
+    ('azpoker.peval', 'peval_ex.evaluate_high_perm', 'evaluate_high_perm'),
+]
+# (module, module attribute, function, stage name) of the functions that are
+# timed through a proxy of a module the instrumented module imported: the
+# regex engine localizes its timestamps with pd.Timestamp directly
+MODULE_STAGES = [
+    ('azpoker.pokerstars_parser', 'pd', 'Timestamp', 'timestamp'),
+]
+# evaluator entry points whose batch sizes are recorded, by argument position
+BATCH_ARGS = {'evaluate_values': 0, 'evaluate_high': 0}
+
+ENABLED = False
+# stage -> [calls, seconds]
+TIMERS = {}
+# name -> count
+COUNTERS = {}
+# stage -> {batch size bucket (power of 2): calls}
+BATCHES = {}
+# HandParseException message -> count
+ERRORS = {}
+# cache name -> {hits, misses} of the worker processes (see merge)
+CACHE_COUNTS = {}
+# (id(owner), name) -> (owner, name, original function), while enabled
+_ORIGINALS = {}
+# canonical.cache_stats() at the last reset
+_CACHE_BASE = {}
+
+
+def _add_time(stage, seconds, calls=1):
+    t = TIMERS.setdefault(stage, [0, 0.])
+    t[0] += calls
+    t[1] += seconds
+
+def count(name, n=1):
+    COUNTERS[name] = COUNTERS.get(name, 0) + n
+
+def _add_batch(stage, size):
+    count(stage + '_items', size)
+    buckets = BATCHES.setdefault(stage, {})
+    bucket = 1 << max(size - 1, 0).bit_length()
+    buckets[bucket] = buckets.get(bucket, 0) + 1
+
+def _timed(func, stage):
+    batch_arg = BATCH_ARGS.get(stage)
+
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        if batch_arg is not None:
+            _add_batch(stage, len(args[batch_arg]))
+        t0 = time.perf_counter()
+        try:
+            return func(*args, **kwargs)
+        finally:
+            _add_time(stage, time.perf_counter() - t0)
+    return wrapper
+
+def _timed_generator(func, stage):
+    # only the time spent producing items counts, not the consumer's
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        it = func(*args, **kwargs)
+        while True:
+            t0 = time.perf_counter()
+            try:
+                item = next(it)
+            except StopIteration:
+                _add_time(stage, time.perf_counter() - t0)
+                return
+            _add_time(stage, time.perf_counter() - t0, 0)
+            yield item
+    return wrapper
+
+def _counted_parser(func):
+    from azpoker.pokerstars_parser import HandParseException
+
+    @functools.wraps(func)
+    def wrapper(s):
+        t0 = time.perf_counter()
+        try:
+            res = func(s)
+        except HandParseException as err:
+            msg = str(err)
+            ERRORS[msg] = ERRORS.get(msg, 0) + 1
+            raise
+        finally:
+            _add_time('parse_hand', time.perf_counter() - t0)
+        count('hands')
+        return res
+    return wrapper
+
+class _ModuleProxy:
+    """A module with some of its functions replaced by timed ones."""
+
+    def __init__(self, module, timed):
+        self._module = module
+        self.__dict__.update(timed)
+
+    def __getattr__(self, name):
+        return getattr(self._module, name)
+
+def _patch(owner, name, wrapper_func):
+    key = (id(owner), name)
+    if key not in _ORIGINALS:
+        original = owner[name] if isinstance(owner, dict) else getattr(owner, name)
+        _ORIGINALS[key] = (owner, name, original)
+        wrapped = wrapper_func(original)
+        if isinstance(owner, dict):
+            owner[name] = wrapped
+        else:
+            setattr(owner, name, wrapped)
+
+def enable():
+    """Starts measuring (the counts so far are kept; see reset)."""
+    global ENABLED
+    if ENABLED:
+        return
+    for modname, name, stage in STAGES:
+        try:
+            owner = importlib.import_module(modname)
+        except ImportError:
+            continue
+        *path, name = name.split('.')
+        for attr in path:
+            owner = getattr(owner, attr)
+        if not hasattr(owner, name):
+            continue
+        timed = _timed_generator if name == 'iter_raw_hands' else _timed
+        _patch(owner, name, functools.partial(timed, stage=stage))
+    for modname, attr, name, stage in MODULE_STAGES:
+        owner = importlib.import_module(modname)
+        _patch(owner, attr, lambda module, name=name, stage=stage: _ModuleProxy(
+            module, {name: _timed(getattr(module, name), stage)}))
+    parsers = sys.modules['azpoker.pokerstars_parser'].PARSERS
+    for name in list(parsers):
+        _patch(parsers, name, _counted_parser)
+    ENABLED = True
+
+def disable():
+    """Stops measuring and restores the original functions."""
+    global ENABLED
+    for owner, name, original in _ORIGINALS.values():
+        if isinstance(owner, dict):
+            owner[name] = original
+        else:
+            setattr(owner, name, original)
+    _ORIGINALS.clear()
+    ENABLED = False
+
+def _cache_stats():
+    canonical = sys.modules.get('azpoker.canonical')
+    return canonical.cache_stats() if canonical is not None else {}
+
+def reset():
+    for registry in (TIMERS, COUNTERS, BATCHES, ERRORS, CACHE_COUNTS):
+        registry.clear()
+    _CACHE_BASE.clear()
+    _CACHE_BASE.update(_cache_stats())
+
+def _cache_counts():
+    """Hits and misses of this process' caches since the last reset."""
+    res = {}
+    for name, c in _cache_stats().items():
+        base = _CACHE_BASE.get(name, {})
+        res[name] = {k: c[k] - base.get(k, 0) for k in ('hits', 'misses')}
+    return res
+
+def snapshot():
+    """The raw counts, as merge() takes them."""
+    return {'timers': {k: list(v) for k, v in TIMERS.items()},
+            'counters': dict(COUNTERS),
+            'batches': {k: dict(v) for k, v in BATCHES.items()},
+            'errors': dict(ERRORS),
+            'caches': _cache_counts()}
+
+def merge(snap):
+    """Adds the counts of a snapshot (e.g. from a worker process)."""
+    for stage, (calls, seconds) in snap['timers'].items():
+        _add_time(stage, seconds, calls)
+    for name, n in snap['counters'].items():
+        count(name, n)
+    for stage, buckets in snap['batches'].items():
+        mine = BATCHES.setdefault(stage, {})
+        for bucket, n in buckets.items():
+            mine[bucket] = mine.get(bucket, 0) + n
+    for msg, n in snap['errors'].items():
+        ERRORS[msg] = ERRORS.get(msg, 0) + n
+    for name, c in snap['caches'].items():
+        mine = CACHE_COUNTS.setdefault(name, {'hits': 0, 'misses': 0})
+        mine['hits'] += c['hits']
+        mine['misses'] += c['misses']
+
+def _collect(func, item):
+    enable()
+    reset()
+    res = func(item)
+    return res, snapshot()
+
+def collecting(func):
+    """func for a worker process: returns (func(item), snapshot of the job)."""
+    return functools.partial(_collect, func)
+
+def report(wall_seconds=None):
+    """A structured summary of the counts since the last reset.
+
+    hands_per_sec is over wall_seconds when given, else over the parse_hand
+    time.
+    """
+    stages = {stage: {'calls': calls, 'seconds': seconds,
+                      'us_per_call': 1e6 * seconds / calls if calls else 0.}
+              for stage, (calls, seconds) in sorted(TIMERS.items())}
+    hands = COUNTERS.get('hands', 0)
+    parse_seconds = TIMERS.get('parse_hand', [0, 0.])[1]
+    seconds = wall_seconds if wall_seconds is not None else parse_seconds
+    evals = COUNTERS.get('evaluate_values_items', 0)
+    eval_seconds = TIMERS.get('evaluate_values', [0, 0.])[1]
+    caches = {}
+    for source in (_cache_counts(), CACHE_COUNTS):
+        for name, c in source.items():
+            mine = caches.setdefault(name, {'hits': 0, 'misses': 0})
+            mine['hits'] += c.get('hits', 0)
+            mine['misses'] += c.get('misses', 0)
+    for c in caches.values():
+        lookups = c['hits'] + c['misses']
+        c['hit_rate'] = c['hits'] / lookups if lookups else 0.
+    return {
+        'time': time.time(),
+        'hands': hands,
+        'seconds': seconds,
+        'hands_per_sec': hands / seconds if seconds else 0.,
+        'errors': dict(sorted(ERRORS.items(), key=lambda x: -x[1])),
+        'evaluations': evals,
+        'evaluations_per_sec': evals / eval_seconds if eval_seconds else 0.,
+        'batch_sizes': {stage: dict(sorted(b.items())) for stage, b in BATCHES.items()},
+        'stages': stages,
+        'caches': caches,
+    }
+
+def export_metrics(fn, rep=None):
+    """Appends a report as one JSON line to a local metrics file."""
+    if rep is None:
+        rep = report()
+    with open(fn, 'a') as f:
+        f.write(json.dumps(rep, sort_keys=True) + '\n')
@@ -0,0 +1,173 @@
+"""Live feed of the hands appended to the files of a hand history directory.
+
+    async for d in tail_hands('hh'):
+        ...
+
+The directory is polled: every interval seconds the files that were
+written recently are stat'ed and those that grew are parsed from where the
+previous read stopped, in an executor so the event loop stays free. A
+hand that is still being written is held back until it is finished (see
+pokerstars_parser.iter_finished_hands). Directories are re-listed when
+their mtime changes, so new session files are picked up on the next poll,
+and files idle for more than idle_after seconds are only checked every
+rescan_interval seconds. Parsed hands go through a queue of maxsize
+hands, so a slow consumer pauses the polling instead of piling up hands.
+"""
+import os
+import re
+import time
+import asyncio
+from azpoker import pokerstars_parser
+
+POLL_INTERVAL = 0.2
+IDLE_AFTER = 600
+RESCAN_INTERVAL = 30
+_DONE = object()
+
+
+class HandTail:
+    """Async iterator over the parsed hands appended under directory.
+
+    By default only hands written after the start are yielded; with
+    from_start the existing hands come first. With manifest set (see
+    pokerstars_parser.load_manifest) the feed resumes where a previous
+    one stopped and the manifest is saved on close. Hands that fail to
+    parse are counted in errcounts by message, like parse_directory.
+    """
+
+    def __init__(self, directory, pattern='.*[.]txt', parser='regex',
+                 interval=POLL_INTERVAL, maxsize=1000, executor=None, from_start=False,
+                 manifest=None, idle_after=IDLE_AFTER, rescan_interval=RESCAN_INTERVAL):
+        self.directory = directory
+        self.pattern = pattern
+        self.parser = parser
+        self.interval = interval
+        self.executor = executor
+        self.from_start = from_start
+        self.manifest = manifest
+        self.idle_after = idle_after
+        self.rescan_interval = rescan_interval
+        self.queue = asyncio.Queue(maxsize)
+        self.task = None
+        # path -> {size, mtime, offset}, as in a parsing manifest
+        self.files = {}
+        if manifest is not None:
+            self.files = pokerstars_parser.load_manifest(manifest)
+        self.dir_mtimes = {}
+        self.last_rescan = 0.
+        self.handcount = 0
+        self.errcounts = {}
+
+    def _list(self, directory, force):
+        """Adds the new files of directory and of its subdirectories that changed."""
+        try:
+            mtime = os.stat(directory).st_mtime
+        except FileNotFoundError:
+            self.dir_mtimes.pop(directory, None)
+            return
+        listed = self.dir_mtimes.get(directory) == mtime
+        self.dir_mtimes[directory] = mtime
+        subdirs = [d for d in self.dir_mtimes if os.path.dirname(d) == directory]
+        if not listed or force:
+            subdirs = []
+            for entry in os.scandir(directory):
+                if entry.is_dir():
+                    subdirs.append(entry.path)
+                elif re.fullmatch(self.pattern, entry.name):
+                    path = os.path.abspath(entry.path)
+                    if path in self.files:
+                        continue
+                    if self.from_start or self.last_rescan:
+                        # files created after the start are read from the start
+                        self.files[path] = {'size': 0, 'mtime': 0., 'offset': 0}
+                    else:
+                        st = entry.stat()
+                        self.files[path] = {'size': st.st_size, 'mtime': st.st_mtime,
+                                            'offset': st.st_size}
+        for d in subdirs:
+            self._list(d, force)
+
+    def changed(self):
+        """(path, offset) of the files that changed since they were last read."""
+        now = time.time()
+        rescan = now - self.last_rescan >= self.rescan_interval
+        self._list(os.path.abspath(self.directory), rescan)
+        if rescan:
+            self.last_rescan = now
+        jobs = []
+        for path, entry in list(self.files.items()):
+            # new files have no mtime yet
+            if not rescan and entry['mtime'] and now - entry['mtime'] > self.idle_after:
+                continue
+            try:
+                st = os.stat(path)
+            except FileNotFoundError:
+                del self.files[path]
+                continue
+            if st.st_size == entry['size'] and st.st_mtime == entry['mtime']:
+                continue
+            if st.st_size < entry['offset']:
+                # truncated or replaced
+                entry['offset'] = 0
+            entry['size'] = st.st_size
+            entry['mtime'] = st.st_mtime
+            jobs.append((path, entry['offset']))
+        return jobs
+
+    async def _poll(self):
+        loop = asyncio.get_running_loop()
+        try:
+            while True:
+                for path, offset in await loop.run_in_executor(None, self.changed):
+                    res, errors, end = await loop.run_in_executor(
+                        self.executor, pokerstars_parser.parse_hhfile_tail, path, offset,
+                        self.parser)
+                    if path in self.files:
+                        self.files[path]['offset'] = end
+                    for _, err in errors:
+                        errmsg = str(err)
+                        self.errcounts[errmsg] = self.errcounts.get(errmsg, 0) + 1
+                    for d in res:
+                        await self.queue.put(d)
+                await asyncio.sleep(self.interval)
+        except Exception as err:
+            await self.queue.put(err)
+        await self.queue.put(_DONE)
+
+    def __aiter__(self):
+        if self.task is None:
+            self.task = asyncio.ensure_future(self._poll())
+        return self
+
+    async def __anext__(self):
+        item = await self.queue.get()
+        if item is _DONE:
+            raise StopAsyncIteration
+        if isinstance(item, Exception):
+            raise item
+        self.handcount += 1
+        return item
+
+    async def close(self):
+        if self.task is not None:
+            self.task.cancel()
+            try:
+                await self.task
+            except asyncio.CancelledError:
+                pass
+            self.task = None
+        if self.manifest is not None:
+            pokerstars_parser.save_manifest(self.manifest, self.files)
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *args):
+        await self.close()
+
+
+async def tail_hands(directory, **kwargs):
+    """Yields the parsed hands appended under directory; see HandTail."""
+    async with HandTail(directory, **kwargs) as tail:
+        async for d in tail:
+            yield d
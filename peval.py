@@ -1,8 +1,57 @@
+import os
 import numpy as np
 import itertools
-import pickle
-from azpoker import peval_ex
-from azpoker.peval_ex import evaluate_high_perm
+import functools
+from math import comb
+try:
+    from azpoker import peval_ex
+except ImportError:
+    # pokerstove isn't built here, fall back to the numpy evaluator
+    from azpoker import peval_np as peval_ex
+from azpoker import ranktable
+from azpoker.handrange import live_range, class_combos, COMBO_CARDS, COMBO_MASKS
+from azpoker.canonical import canonical_mask, canonical_pair, memoize
+
+# memory-mapped rank tables (see ranktable.py), used instead of the
+# evaluator for the card counts they cover
+RANK_TABLE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'rank_tables')
+RANK_TABLES = ranktable.load_rank_tables(RANK_TABLE_DIR)
+
+def use_rank_tables(directory):
+    RANK_TABLES.clear()
+    RANK_TABLES.update(ranktable.load_rank_tables(directory))
+
+# threads of the evaluator for batches of at least EVAL_THREADS_MIN masks
+EVAL_THREADS = 1
+EVAL_THREADS_MIN = 100000
+
+def evaluate_values(masks):
+    """Comparable values of masks, which must all hold the same number of cards.
+
+    The values are ranks from the rank table when there is one for that
+    many cards and evaluator codes otherwise, so they can only be compared
+    with values from the same call.
+    """
+    masks = np.asarray(masks, dtype=np.int64)
+    if len(masks) and bin(int(masks[0])).count('1') in RANK_TABLES:
+        return ranktable.lookup(RANK_TABLES, masks)
+    res = np.zeros(len(masks), dtype=np.int32)
+    threads = EVAL_THREADS if len(masks) >= EVAL_THREADS_MIN else 1
+    peval_ex.evaluate_high(masks, res, threads)
+    return res
+
+def _spot_key(hc_mask, board_mask, reduce_splits=True, hrange=None):
+    # percentiles against every holding don't change with the suit labels;
+    # those against a given range do, and aren't cached
+    if hrange is not None:
+        return None
+    return canonical_pair(int(hc_mask), int(board_mask)) + (bool(reduce_splits),)
+
+@memoize('evaluate_high_perm', _spot_key)
+def evaluate_high_perm(hc1, board, rs=True):
+    if bin(hc1 | board).count('1') in RANK_TABLES:
+        return get_sd_rank_high(hc1, board, rs)
+    return peval_ex.evaluate_high_perm(hc1, board, rs)
 
 SUIT_CODE = {
     'c': 0,
@@ -69,6 +118,7 @@ def handmask_to_codes(mask):
 def handmask_to_str(mask):
     return "".join([CODE_TO_CARD[x] for x in handmask_to_codes(mask)])
 
+@memoize('rank_flushdraw', lambda fv, ncards: (fv, ncards))
 def rank_flushdraw(fv, ncards):
     fv_code = RANK_CODE[fv]
     assert fv_code > RANK_CODE['2']
@@ -88,19 +138,37 @@ def rank_flushdraw(fv, ncards):
         all_pctiles.append(pctile)
     return np.median(all_pctiles)
 
-def get_sd_rank_high(hcs1_mask, board_mask, reduce_splits=True):
+def weighted_pctile(value, others, weights=None, reduce_splits=True):
+    """Share of the (weighted) values in others that value beats, counting
+    ties as half a win with reduce_splits."""
+    if weights is None:
+        weights = np.ones(len(others))
+    wins = np.sum(weights[value > others])
+    ties = np.sum(weights[value == others])
+    if reduce_splits:
+        return (wins + ties / 2) / np.sum(weights)
+    return (wins + ties) / np.sum(weights)
+
+@memoize('get_sd_rank_high', _spot_key)
+def get_sd_rank_high(hcs1_mask, board_mask, reduce_splits=True, hrange=None):
+    """Showdown percentile of hcs1 on board against every other holding, or
+    against the live combos of hrange (a Range or a list of masks) weighted
+    by their weights."""
+    mask1 = hcs1_mask | board_mask
+    if hrange is not None:
+        other_masks, weights = live_range(hrange, mask1)
+        res = evaluate_values(np.concatenate([[mask1], other_masks | board_mask]))
+        return weighted_pctile(res[0], res[1:], weights, reduce_splits)
     deck = set(range(52))
     hcs1_codes = handmask_to_codes(hcs1_mask)
     board_codes = handmask_to_codes(board_mask)
     deck = list(deck.difference(hcs1_codes).difference(board_codes))
     assert len(deck) == 52 - len(hcs1_codes) - len(board_codes)
-    mask1 = hcs1_mask | board_mask
-    other_masks = peval_ex.calc_permutations(deck, 2)
-    other_masks = [x | board_mask for x in other_masks]
-    masks = [mask1] + other_masks
-    masks = np.array(masks, dtype=np.int64)
-    res = np.zeros(len(masks), dtype=np.int32)
-    peval_ex.evaluate_high(masks, res)
+    masks = np.empty(comb(len(deck), 2) + 1, dtype=np.int64)
+    masks[0] = mask1
+    peval_ex.calc_permutations(deck, 2, masks[1:])
+    masks[1:] |= board_mask
+    res = evaluate_values(masks)
     rank1 = res[0]
     # all_ranks = np.sort(res[1:])
     if reduce_splits:
@@ -109,71 +177,129 @@ def get_sd_rank_high(hcs1_mask, board_mask, reduce_splits=True):
         pctile = np.sum(rank1 >= res[1:]) / (len(res) - 1)
     return pctile
 
+HOLDING_CARDS = COMBO_CARDS
+HOLDING_MASKS = COMBO_MASKS
+
+def rank_board(board_mask, reduce_splits=True):
+    """Showdown percentiles of every holding on board_mask at once.
+
+    Returns (holdings, pctiles): the masks of the 2-card holdings that don't
+    conflict with the board, and for each the same value get_sd_rank_high
+    gives. Every holding is evaluated once and the values sorted; the
+    holdings a hand beats are counted by binary search among all of them,
+    minus those sharing one of its cards (card removal), which are counted
+    the same way per card.
+    """
+    live = (HOLDING_MASKS & board_mask) == 0
+    holdings = HOLDING_MASKS[live]
+    cards = HOLDING_CARDS[live]
+    values = evaluate_values(holdings | board_mask).astype(np.int64)
+    nvalues = values.max() + 2 if len(values) else 1
+
+    # every holding under both of its cards, sorted by card then value
+    keys = np.sort(np.concatenate([cards[:, 0] * nvalues + values,
+                                   cards[:, 1] * nvalues + values]))
+    everything = np.sort(values)
+
+    def count(v, side):
+        # holdings with a lower value (side='left') or lower or equal
+        # (side='right') that don't share a card with the holding
+        res = np.searchsorted(everything, v, side)
+        for c in (cards[:, 0], cards[:, 1]):
+            res -= np.searchsorted(keys, c * nvalues + v, side) - \
+                np.searchsorted(keys, c * nvalues)
+        return res
+
+    below = count(values, 'left')
+    # the holding itself is in both card groups and in neither count...
+    below_or_equal = count(values, 'right') + 1
+    # ...and the opponents are dealt from a deck two cards shorter
+    ndeck = 52 - bin(board_mask).count('1') - 2
+    nother = ndeck * (ndeck - 1) // 2
+    if reduce_splits:
+        pctiles = (below + (below_or_equal - below) / 2) / nother
+    else:
+        pctiles = below_or_equal / nother
+    return holdings, pctiles
+
 def out_value(pctile, steepness=2):
     """Calculates a multiplier describing goodness of an out.
     
-    0 <= pctile <= 1
+    0 <= pctile <= 1, scalar or array
     """
     #res = 2.01347589399817 / (1 + np.e**(-2*((pctile - .8)*5))) - 1
-    if pctile <= .8:
-        return 0
-    res = ((pctile - .8)*5) ** steepness
-    return res
-out_value = np.vectorize(out_value, otypes=[np.float])
+    pctile = np.asarray(pctile, dtype=np.float64)
+    return np.where(pctile <= .8, 0., (np.maximum(pctile - .8, 0) * 5) ** steepness)
+
+# evaluations per batch of calc_forward_value
+FORWARD_BATCH_SIZE = 1 << 20
 
 def calc_forward_value(hcs1_mask, board_mask, numstreets=1, hrange=None, reduce_splits=True):
+    """Percentile of hcs1 now and after every runout of numstreets cards.
+
+    All the runouts x opponent holdings are evaluated as one array (in
+    batches of FORWARD_BATCH_SIZE masks) and the percentiles reduced per
+    runout. hrange may be a weighted Range.
+    """
     hcs1_codes = handmask_to_codes(hcs1_mask)
     board_codes = handmask_to_codes(board_mask)
     deck = set(range(52)).difference(hcs1_codes).difference(board_codes)
     deck = list(deck)
-    forward_masks = peval_ex.calc_permutations(deck, numstreets)
-    forward_masks = [x | board_mask for x in forward_masks]
-    pctiles = np.zeros(len(forward_masks))
+    runouts = peval_ex.calc_permutations(deck, numstreets)
+    if hrange is None:
+        others = HOLDING_MASKS[(HOLDING_MASKS & (hcs1_mask | board_mask)) == 0]
+        weights = np.ones(len(others))
+    else:
+        others, weights = live_range(hrange, hcs1_mask | board_mask)
     pctile_now = get_high_pctile(hcs1_mask, board_mask, hrange, reduce_splits)
-    for i, fwdmask in enumerate(forward_masks):
-        pctile = get_high_pctile(hcs1_mask, fwdmask, hrange, reduce_splits)
-        pctiles[i] = pctile
-        # print(handmask_to_str(fwdmask), pctile, out_value(pctile, 1.5))
+    pctiles = np.zeros(len(runouts))
+    step = max(1, FORWARD_BATCH_SIZE // max(len(others), 1))
+    for i in range(0, len(runouts), step):
+        fwd = runouts[i:i+step, None] | board_mask
+        live = (others & fwd) == 0
+        # the hero first, then the live opponents of every runout
+        values = evaluate_values(np.concatenate([fwd[:, 0] | hcs1_mask,
+                                                 (others | fwd)[live]]))
+        hero = values[:len(fwd)]
+        res = np.zeros(live.shape, dtype=values.dtype)
+        res[live] = values[len(fwd):]
+        hero = hero[:, None]
+        w = live * weights
+        wins = np.sum(w * (hero > res), axis=1)
+        ties = np.sum(w * (hero == res), axis=1)
+        if reduce_splits:
+            wins += ties / 2
+        else:
+            wins += ties
+        pctiles[i:i+step] = wins / np.sum(w, axis=1)
     return pctile_now, pctiles
 
-DEPR_FN = "/".join("/home/seb/pylib/azpoker/peval.py".split('/')[:-1]) + "/flop_depr_85.p"
-DEPR_DICT = pickle.load(open(DEPR_FN, 'rb'))
-def get_flop_depr(boardmask):
-    return DEPR_DICT[boardmask]
+# flop depreciation tables, one entry per suit-canonical flop, made by
+# python -m azpoker.flopdepr
+DEPR_THRESHOLD = 85
+DEPR_FN = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'flop_depr_{}.npy')
+
+@functools.lru_cache(maxsize=None)
+def load_flop_depr(threshold=DEPR_THRESHOLD):
+    """The (flop, depr) table sorted by canonical flop mask, memory-mapped."""
+    return np.load(DEPR_FN.format(threshold), mmap_mode='r')
+
+def get_flop_depr(boardmask, threshold=DEPR_THRESHOLD):
+    table = load_flop_depr(threshold)
+    key = canonical_mask(boardmask)
+    i = np.searchsorted(table['flop'], key)
+    if i == len(table) or table['flop'][i] != key:
+        raise KeyError(boardmask)
+    return table['depr'][i]
 
 COMBOS_52_2 = list(itertools.combinations(range(52), 2))
 def extract_hc_instances(hc):
-    res = []
-    c1 = handmask_to_codes(hc)
-    ns1 = len(set([x // 13 for x in c1]))
-    r1 = set([x % 13 for x in c1])
-    for c2 in COMBOS_52_2:
-        ns2 = len(set([x // 13 for x in c2]))
-        r2 = set([x % 13 for x in c2])
-        if ns2 == ns1 and r1 == r2:
-            res.append(codes_to_mask(c2))
-    return res
+    """The combos of the hand class of hc, as a read-only array of masks."""
+    return class_combos(hc)
 
 def get_high_pctile(hcs1_mask, board_mask, hrange=None, reduce_splits=True):
+    # cached through evaluate_high_perm without a range
     if hrange is None:
         return evaluate_high_perm(hcs1_mask, board_mask, reduce_splits)
     else:
-        deck = set(range(52))
-        hcs1_codes = handmask_to_codes(hcs1_mask)
-        board_codes = handmask_to_codes(board_mask)
-        deck = list(deck.difference(hcs1_codes).difference(board_codes))
-        assert len(deck) == 52 - len(hcs1_codes) - len(board_codes)
-        mask1 = hcs1_mask | board_mask
-        other_masks = [x for x in hrange if x & mask1 == 0]
-        other_masks = [x | board_mask for x in other_masks]
-        masks = [mask1] + other_masks
-        masks = np.array(masks, dtype=np.int64)
-        res = np.zeros(len(masks), dtype=np.int32)
-        peval_ex.evaluate_high(masks, res)
-        rank1 = res[0]
-        # all_ranks = np.sort(res[1:])
-        if reduce_splits:
-            pctile = (np.sum(rank1 > res[1:]) + np.sum(rank1 == res[1:]) / 2) / (len(res) - 1)
-        else:
-            pctile = np.sum(rank1 >= res[1:]) / (len(res) - 1)
-        return pctile
+        return get_sd_rank_high(hcs1_mask, board_mask, reduce_splits, hrange)
@@ -1,20 +1,45 @@
 import itertools
+from math import comb
 import numpy as np
+from cython.parallel cimport prange
 from libcpp.string cimport string
 from libcpp.vector cimport vector
 from libcpp cimport bool
 
 ctypedef long long int64
 
-cdef extern from "peval.hpp":
+cdef extern from *:
+    int __builtin_ctzll(unsigned long long) nogil
+
+cdef extern from "peval.hpp" nogil:
     void c_evaluate_high "evaluate_high" (int64* masks,int numevals, int* out)
     double c_evaluate_high_perm "evaluate_high_perm" (int64 hc1, int64 board, bool rs)
 
-def evaluate_high(int64[:] masks, int[:] out):
-    c_evaluate_high(&masks[0], masks.shape[0], &out[0])
+def evaluate_high(int64[:] masks, int[:] out, int threads=1):
+    """Evaluates masks into out without holding the GIL, split into threads
+    chunks evaluated in parallel when threads > 1."""
+    cdef Py_ssize_t n = masks.shape[0]
+    cdef Py_ssize_t chunk, i, start, end
+    if out.shape[0] < n:
+        raise ValueError("out is shorter than masks")
+    if n == 0:
+        return
+    if threads <= 1:
+        with nogil:
+            c_evaluate_high(&masks[0], <int>n, &out[0])
+        return
+    chunk = (n + threads - 1) // threads
+    for i in prange(threads, nogil=True, num_threads=threads, schedule='static'):
+        start = i * chunk
+        end = min(start + chunk, n)
+        if start < end:
+            c_evaluate_high(&masks[start], <int>(end - start), &out[start])
 
 def evaluate_high_perm(int64 hc1, int64 board, bool rs=True):
-    return c_evaluate_high_perm(hc1, board, rs)
+    cdef double res
+    with nogil:
+        res = c_evaluate_high_perm(hc1, board, rs)
+    return res
 
 def handmask_to_codes(int64 mask):
     codes = []
@@ -32,6 +57,95 @@ def codes_to_mask(codes):
         handmask |= mask
     return handmask
 
-def calc_permutations(list deck, int picks):
-    res = [codes_to_mask(x) for x in itertools.combinations(deck, picks)]
-    return res
+def calc_permutations(deck, int picks, int64[:] out=None):
+    """Masks of all the picks-card combinations of the cards in deck, in
+    itertools.combinations order, as an int64 array (a view of out when
+    given, which needs room for all of them)."""
+    cdef int n = len(deck)
+    cdef Py_ssize_t total = comb(n, picks) if 0 <= picks <= n else 0
+    if out is None:
+        out = np.empty(total, dtype=np.int64)
+    elif out.shape[0] < total:
+        raise ValueError("out has room for {} of {} combinations".format(out.shape[0], total))
+    if total == 0:
+        return np.asarray(out[:0])
+    cdef int64[:] bits = np.array([1 << c for c in deck], dtype=np.int64)
+    cdef int idx[64]
+    cdef int i, j
+    cdef Py_ssize_t pos = 0
+    cdef int64 m
+    with nogil:
+        for i in range(picks):
+            idx[i] = i
+        while True:
+            m = 0
+            for i in range(picks):
+                m |= bits[idx[i]]
+            out[pos] = m
+            pos += 1
+            # the rightmost index that can still move right, then reset
+            # the ones after it
+            i = picks - 1
+            while i >= 0 and idx[i] == i + n - picks:
+                i -= 1
+            if i < 0:
+                break
+            idx[i] += 1
+            for j in range(i + 1, picks):
+                idx[j] = idx[j - 1] + 1
+    return np.asarray(out[:total])
+
+# BINOM[n][k] for the colex ranks
+cdef int64 BINOM[53][53]
+for _n in range(53):
+    for _k in range(53):
+        BINOM[_n][_k] = comb(_n, _k)
+
+def colex_rank(int64[:] masks, int64[:] out=None):
+    """Colexicographic index of every mask among the masks with as many cards,
+    the same index as ranktable.colex_index."""
+    cdef Py_ssize_t n = masks.shape[0], i
+    cdef int64 m, rank
+    cdef int k, c
+    if out is None:
+        out = np.empty(n, dtype=np.int64)
+    elif out.shape[0] < n:
+        raise ValueError("out is shorter than masks")
+    with nogil:
+        for i in range(n):
+            m = masks[i]
+            rank = 0
+            k = 0
+            while m:
+                c = __builtin_ctzll(m)
+                k += 1
+                rank += BINOM[c][k]
+                m &= m - 1
+            out[i] = rank
+    return np.asarray(out[:n])
+
+def colex_unrank(int64[:] indices, int k, int64[:] out=None):
+    """The k-card masks with the given colex indices."""
+    cdef Py_ssize_t n = indices.shape[0], i
+    cdef int64 rank, m
+    cdef int j, c
+    if not 0 <= k <= 52:
+        raise ValueError("Bad number of cards: {}".format(k))
+    if out is None:
+        out = np.empty(n, dtype=np.int64)
+    elif out.shape[0] < n:
+        raise ValueError("out is shorter than indices")
+    with nogil:
+        for i in range(n):
+            rank = indices[i]
+            m = 0
+            c = 52
+            # the highest card first: the largest c with BINOM[c][j] <= rank
+            for j in range(k, 0, -1):
+                c -= 1
+                while BINOM[c][j] > rank:
+                    c -= 1
+                m |= (<int64>1) << c
+                rank -= BINOM[c][j]
+            out[i] = m
+    return np.asarray(out[:n])
@@ -0,0 +1,182 @@
+"""Vectorized NumPy hand evaluator, a drop-in backend for peval_ex.
+
+Masks use the same 52-bit layout as peval (bit rank + 13 * suit, suits in
+cdhs order). A whole array of masks is evaluated at once: each mask is
+split into its four 13-bit suit masks, and ranks, pairs, trips, quads,
+flushes and straights are found with bitwise operations and 8192-entry
+lookup tables.
+
+The codes are type << 24 | major rank << 20 | minor rank << 16 | kickers,
+where type goes from 0 (high card) to 8 (straight flush) and kickers is
+a 13-bit mask of the kicker ranks. Codes order hands exactly like
+pokerstove's evaluateHigh().code(), but the raw values are not the same,
+so codes from different backends must not be compared with each other.
+"""
+import itertools
+from math import comb
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+
+HIGH_CARD, ONE_PAIR, TWO_PAIR, THREE_OF_A_KIND, STRAIGHT, FLUSH, FULL_HOUSE, \
+    FOUR_OF_A_KIND, STRAIGHT_FLUSH = range(9)
+TYPE_SHIFT = 24
+MAJOR_SHIFT = 20
+MINOR_SHIFT = 16
+RANK_MASK = 0x1FFF
+CHUNK_SIZE = 1 << 16
+
+def _make_tables():
+    idx = np.arange(1 << 13)
+    bits = (idx[:, None] >> np.arange(13)) & 1
+    popcount = bits.sum(axis=1).astype(np.int8)
+    # highest rank present, -1 for an empty mask
+    top = np.where(idx > 0, 12 - np.argmax(bits[:, ::-1], axis=1), -1).astype(np.int8)
+    # masks of the n highest ranks present
+    topn = {}
+    rest = idx.copy()
+    acc = np.zeros_like(idx)
+    for n in range(1, 6):
+        hi = np.where(rest > 0, 1 << np.maximum(top[rest].astype(np.int64), 0), 0)
+        acc = acc | hi
+        rest = rest & ~hi
+        topn[n] = acc.astype(np.int32)
+    # 1 + the highest rank of a straight, 0 when there is none; the wheel
+    # counts as five high
+    straight = np.zeros(1 << 13, dtype=np.int8)
+    wheel = (1 << 12) | 0xF
+    straight[(idx & wheel) == wheel] = 4
+    for hi in range(4, 13):
+        run = 0x1F << (hi - 4)
+        straight[(idx & run) == run] = hi + 1
+    return popcount, top, topn, straight
+
+POPCOUNT, TOP, TOPN, STRAIGHT_TOP = _make_tables()
+
+def _evaluate_chunk(masks):
+    s = [((masks >> (13 * k)) & RANK_MASK).astype(np.intp) for k in range(4)]
+    s0, s1, s2, s3 = s
+    ranks = s0 | s1 | s2 | s3
+    pairs = (s0 & s1) | (s0 & s2) | (s0 & s3) | (s1 & s2) | (s1 & s3) | (s2 & s3)
+    trips = (s0 & s1 & s2) | (s0 & s1 & s3) | (s0 & s2 & s3) | (s1 & s2 & s3)
+    quads = s0 & s1 & s2 & s3
+    # with at most 9 cards only one suit can hold a flush
+    flush = np.zeros_like(ranks)
+    for sk in s:
+        flush = np.where(POPCOUNT[sk] >= 5, sk, flush)
+
+    def code(hand_type, major=0, minor=0, kickers=0):
+        return (hand_type << TYPE_SHIFT) | (major << MAJOR_SHIFT) | \
+            (minor << MINOR_SHIFT) | kickers
+
+    def drop(mask, rank):
+        return mask & ~(1 << np.maximum(rank, 0))
+
+    sf_top = STRAIGHT_TOP[flush].astype(np.int32)
+    st_top = STRAIGHT_TOP[ranks].astype(np.int32)
+    quad = TOP[quads].astype(np.int32)
+    trip = TOP[trips].astype(np.int32)
+    pair = TOP[pairs].astype(np.int32)
+    # the pair of a full house, or the second pair of two pair
+    pair2 = TOP[drop(pairs, trip)].astype(np.int32)
+    low_pair = TOP[drop(pairs, pair)].astype(np.int32)
+    conds = [
+        sf_top > 0,
+        quads != 0,
+        (trips != 0) & (pair2 >= 0),
+        flush != 0,
+        st_top > 0,
+        trips != 0,
+        low_pair >= 0,
+        pairs != 0,
+    ]
+    choices = [
+        code(STRAIGHT_FLUSH, sf_top - 1),
+        code(FOUR_OF_A_KIND, quad, 0, TOPN[1][drop(ranks, quad)]),
+        code(FULL_HOUSE, trip, pair2),
+        code(FLUSH, 0, 0, TOPN[5][flush]),
+        code(STRAIGHT, st_top - 1),
+        code(THREE_OF_A_KIND, trip, 0, TOPN[2][drop(ranks, trip)]),
+        code(TWO_PAIR, pair, low_pair, TOPN[1][drop(drop(ranks, pair), low_pair)]),
+        code(ONE_PAIR, pair, 0, TOPN[3][drop(ranks, pair)]),
+    ]
+    return np.select(conds, choices, code(HIGH_CARD, 0, 0, TOPN[5][ranks]))
+
+def evaluate_high(masks, out, threads=1):
+    """Evaluates the best high hand of every int64 card mask into out (int32).
+
+    With threads > 1 the chunks are evaluated by a thread pool; numpy
+    releases the GIL for most of the work.
+    """
+    masks = np.asarray(masks, dtype=np.int64)
+    if len(out) < len(masks):
+        raise ValueError("out is shorter than masks")
+
+    def run(i):
+        out[i:i+CHUNK_SIZE] = _evaluate_chunk(masks[i:i+CHUNK_SIZE])
+
+    starts = range(0, len(masks), CHUNK_SIZE)
+    if threads > 1 and len(starts) > 1:
+        with ThreadPoolExecutor(max_workers=threads) as pool:
+            list(pool.map(run, starts))
+    else:
+        for i in starts:
+            run(i)
+    return out
+
+ALL_PAIRS = np.array([(1 << a) | (1 << b) for a, b in itertools.combinations(range(52), 2)],
+                     dtype=np.int64)
+
+def evaluate_high_perm(hc1, board, rs=True):
+    """Fraction of the two-card hands from the remaining deck that hc1 beats on
+    board, counting a split as half a win when rs is set."""
+    others = ALL_PAIRS[(ALL_PAIRS & (hc1 | board)) == 0] | board
+    masks = np.concatenate([[hc1 | board], others]).astype(np.int64)
+    res = evaluate_high(masks, np.zeros(len(masks), dtype=np.int32))
+    if rs:
+        return (np.sum(res[0] > res[1:]) + np.sum(res[0] == res[1:]) / 2) / (len(res) - 1)
+    return np.sum(res[0] >= res[1:]) / (len(res) - 1)
+
+def calc_permutations(deck, picks, out=None):
+    """Masks of all the picks-card combinations of the cards in deck, in
+    itertools.combinations order, as an int64 array (a view of out when
+    given)."""
+    bits = np.int64(1) << np.asarray(deck, dtype=np.int64)
+    idx = np.array(list(itertools.combinations(range(len(deck)), picks)), dtype=np.intp)
+    idx = idx.reshape(comb(len(deck), picks), picks)
+    if out is None:
+        out = np.empty(len(idx), dtype=np.int64)
+    elif len(out) < len(idx):
+        raise ValueError("out has room for {} of {} combinations".format(len(out), len(idx)))
+    out[:len(idx)] = np.bitwise_or.reduce(bits[idx], axis=1) if picks else 0
+    return out[:len(idx)]
+
+BINOM = np.array([[comb(n, k) for k in range(53)] for n in range(53)], dtype=np.int64)
+
+def colex_rank(masks, out=None):
+    """Colexicographic index of every mask among the masks with as many cards,
+    the same index as ranktable.colex_index."""
+    masks = np.asarray(masks, dtype=np.int64)
+    rank = np.zeros(len(masks), dtype=np.int64)
+    count = np.zeros(len(masks), dtype=np.intp)
+    for c in range(52):
+        bit = (masks >> c) & 1
+        count += bit
+        rank += bit * BINOM[c, count]
+    if out is None:
+        return rank
+    out[:len(rank)] = rank
+    return out[:len(rank)]
+
+def colex_unrank(indices, k, out=None):
+    """The k-card masks with the given colex indices."""
+    rank = np.array(indices, dtype=np.int64)
+    masks = np.zeros(len(rank), dtype=np.int64)
+    for j in range(k, 0, -1):
+        # the largest c with BINOM[c, j] <= rank
+        c = np.searchsorted(BINOM[:, j], rank, side='right') - 1
+        masks |= np.int64(1) << c
+        rank -= BINOM[c, j]
+    if out is None:
+        return masks
+    out[:len(masks)] = masks
+    return out[:len(masks)]
@@ -1,6 +1,20 @@
 import re
 import copy
 import os
+import locale
+import json
+import gzip
+import bz2
+import lzma
+import codecs
+import zipfile
+import functools
+import itertools
+import collections
+import time
+from datetime import timedelta
+from collections.abc import Mapping
+from concurrent.futures import ProcessPoolExecutor
 import numpy as np
 import pandas as pd
 
@@ -24,8 +38,197 @@ def find_files(directory, pattern, results=None):
             results.append(fullpath)
     return results       
 
-def parse_directory(directory, verbosity=1):
-    hhfiles = find_files(directory, '.*[.]txt')
+# plain and compressed hand history files; the .txt members of a .zip
+# archive are listed as archive.zip/member.txt
+HH_PATTERN = r'.*[.]txt([.](gz|bz2|xz))?|.*[.]zip'
+COMPRESSED_OPENERS = {'.gz': gzip.open, '.bz2': bz2.open, '.xz': lzma.open}
+ZIP_MEMBER_PATTERN = r'.*[.]txt'
+# errors that make a whole file unreadable (e.g. a truncated archive); the
+# file is skipped and counted like parse_directory's skipped files
+STREAM_ERRORS = (UnicodeDecodeError, EOFError, OSError, lzma.LZMAError, zipfile.BadZipFile)
+
+@functools.lru_cache(maxsize=64)
+def _zip_members(zipfn, mtime):
+    """{member name: uncompressed size} of the hand history files of a zip."""
+    with zipfile.ZipFile(zipfn) as zf:
+        return {zi.filename: zi.file_size for zi in zf.infolist()
+                if not zi.is_dir() and re.fullmatch(ZIP_MEMBER_PATTERN, os.path.basename(zi.filename))}
+
+def _split_zip(fn):
+    """(archive, member) of a zip member path, or None for other files."""
+    i = fn.lower().find('.zip' + os.sep)
+    if i < 0:
+        return None
+    return fn[:i + 4], fn[i + 5:].replace(os.sep, '/')
+
+def find_hhfiles(directory):
+    """Hand history files under directory, with zip archives expanded into
+    their members."""
+    res = []
+    for fn in find_files(directory, HH_PATTERN):
+        if fn.lower().endswith('.zip'):
+            members = _zip_members(fn, os.stat(fn).st_mtime)
+            res.extend(os.path.join(fn, *m.split('/')) for m in sorted(members))
+        else:
+            res.append(fn)
+    return res
+
+def is_archived(fn):
+    """Whether fn is a compressed file or a zip member, i.e. a finished
+    file that is replaced rather than appended to."""
+    return _split_zip(fn) is not None or \
+        os.path.splitext(fn)[1].lower() in COMPRESSED_OPENERS
+
+def stat_hhfile(fn):
+    """(size, mtime) of a hand history file; zip members have their
+    uncompressed size and the mtime of the archive."""
+    z = _split_zip(fn)
+    if z is None:
+        st = os.stat(fn)
+        return st.st_size, st.st_mtime
+    mtime = os.stat(z[0]).st_mtime
+    return _zip_members(z[0], mtime)[z[1]], mtime
+
+def open_hhfile(fn):
+    """Opens a plain, gzip/bz2/xz compressed or zip member hand history
+    file as a binary stream of its uncompressed contents."""
+    z = _split_zip(fn)
+    if z is not None:
+        zf = zipfile.ZipFile(z[0])
+        try:
+            f = zf.open(z[1])
+        finally:
+            # the member stream keeps the archive file open until it is closed
+            zf.close()
+        return f
+    opener = COMPRESSED_OPENERS.get(os.path.splitext(fn)[1].lower(), open)
+    return opener(fn, 'rb')
+
+def map_files(func, fns, workers=None):
+    """Applies func to every file name and yields the results in order.
+
+    With workers > 1 the files are processed in a pool of that many
+    processes, with at most two files per worker in flight so finished
+    results don't pile up ahead of the consumer. An exception raised for
+    one file is re-raised when its turn comes, and a crashed worker
+    surfaces as BrokenProcessPool instead of hanging the pool; either way
+    the remaining work is cancelled.
+    """
+    if not workers or workers < 2:
+        for fn in fns:
+            yield func(fn)
+        return
+    pool = ProcessPoolExecutor(max_workers=workers)
+    pending = collections.deque()
+    try:
+        for fn in fns:
+            pending.append(pool.submit(func, fn))
+            if len(pending) >= 2 * workers:
+                yield pending.popleft().result()
+        while pending:
+            yield pending.popleft().result()
+    finally:
+        for fut in pending:
+            fut.cancel()
+        pool.shutdown()
+
+def load_manifest(fn):
+    """Loads an incremental parsing manifest, {path: {size, mtime, offset}}."""
+    if not os.path.exists(fn):
+        return {}
+    with open(fn) as f:
+        return json.load(f)
+
+def save_manifest(fn, manifest):
+    tmpfn = fn + '.tmp'
+    with open(tmpfn, 'w') as f:
+        json.dump(manifest, f, indent=0, sort_keys=True)
+    os.replace(tmpfn, fn)
+
+def plan_incremental(hhfiles, manifest):
+    """Returns (fn, offset, size, mtime, final) jobs for the files that changed.
+
+    Unchanged files are skipped, files that grew are resumed from the offset
+    recorded in the manifest and files that shrank are parsed from scratch.
+    An unchanged file whose last hand was held back as unfinished is
+    resumed with final set: it stopped growing, so the hand is complete.
+
+    Compressed files and zip members are parsed whole, with final set,
+    whenever they change: their recorded size is on-disk bytes while
+    offsets count uncompressed bytes, so they can't be resumed.
+    """
+    jobs = []
+    for fn in hhfiles:
+        size, mtime = stat_hhfile(fn)
+        entry = manifest.get(os.path.abspath(fn))
+        offset = 0
+        final = False
+        if is_archived(fn):
+            if entry is None or entry['size'] != size or entry['mtime'] != mtime:
+                jobs.append((fn, 0, size, mtime, True))
+            continue
+        if entry is not None:
+            if entry['size'] == size and entry['mtime'] == mtime:
+                if entry['offset'] >= size:
+                    continue
+                final = True
+            if entry['size'] <= size:
+                offset = entry['offset']
+        jobs.append((fn, offset, size, mtime, final))
+    return jobs
+
+def _parse_job(job, parser='regex'):
+    return parse_hhfile_tail(job[0], job[1], parser, job[4])
+
+def parse_directory(directory, verbosity=1, workers=None, manifest=None, sink=None,
+                    parser='regex', report=False):
+    """Parses all the hand history files found under directory.
+
+    Files compressed with gzip, bz2 or xz and the members of zip archives
+    are read as streams (see find_hhfiles), each file or member being a
+    separate job, so with workers > 1 they are decompressed in parallel.
+
+    With manifest set to a file name the run is incremental: only new files
+    and the hands appended to files that grew since the previous run are
+    parsed, and the manifest is updated once all the files are done.
+
+    With sink set (e.g. a handstore.HandStore), the parsed hands are passed
+    to sink.extend() file by file instead of being collected in res.
+
+    parser selects the parse_hand engine from PARSERS.
+
+    With report set, the run is measured (see instrument) and a report of
+    its stages, throughput, errors and cache hit rates is returned as a
+    fourth value. When instrumentation is already on, the counts are added
+    to the caller's and the report covers them all.
+    """
+    if not report:
+        return _parse_directory(directory, verbosity, workers, manifest, sink, parser)[:3]
+    from azpoker import instrument
+    was_enabled = instrument.ENABLED
+    if not was_enabled:
+        instrument.enable()
+        instrument.reset()
+    t0 = time.perf_counter()
+    try:
+        res, errcounts, skipped_files, nfiles = _parse_directory(
+            directory, verbosity, workers, manifest, sink, parser,
+            collect=bool(workers and workers >= 2))
+        rep = instrument.report(time.perf_counter() - t0)
+    finally:
+        if not was_enabled:
+            instrument.disable()
+    rep['files'] = nfiles
+    rep['skipped_files'] = skipped_files
+    return res, errcounts, skipped_files, rep
+
+def _parse_directory(directory, verbosity, workers, manifest, sink, parser, collect=False):
+    """parse_directory without the report, plus the number of files parsed;
+    with collect the instrument counts of the worker processes are merged
+    into this one's."""
+    hhfiles = find_hhfiles(directory)
+    if collect:
+        from azpoker import instrument
     res = []
     handcount = 0
     errcounts = {}
@@ -33,10 +236,31 @@ def parse_directory(directory, verbosity=1):
     def prt(s='', lvl=1, end='\n'):
         if lvl <= verbosity:
             print(s, end=end)
-    for i, fn in enumerate(hhfiles):
-        #print(fn)
+    if manifest is None:
+        func = functools.partial(parse_hhfile, parser=parser)
+        items = hhfiles
+    else:
+        entries = load_manifest(manifest)
+        jobs = plan_incremental(hhfiles, entries)
+        func = functools.partial(_parse_job, parser=parser)
+        items = jobs
+    results = map_files(instrument.collecting(func) if collect else func, items, workers)
+    if manifest is not None:
+        prt("{} of {} files changed".format(len(jobs), len(hhfiles)))
+        found = set(os.path.abspath(fn) for fn in hhfiles)
+        hhfiles = [job[0] for job in jobs]
+    # progress is printed here as results arrive, so output from the
+    # workers is merged in file order
+    for i, result in enumerate(results):
+        if collect:
+            result, snap = result
+            instrument.merge(snap)
+        newres, errors = result[:2]
+        if manifest is not None:
+            fn, _, size, mtime, _ = jobs[i]
+            entries[os.path.abspath(fn)] = {'size': size, 'mtime': mtime,
+                                            'offset': result[2]}
         prt("{}/{}".format(i + 1, len(hhfiles)), end='')
-        newres, errors = parse_hhfile(fn)
         handcount += len(newres)
         prt(": {:,}".format(handcount), end='')
         if errors:
@@ -50,40 +274,133 @@ def parse_directory(directory, verbosity=1):
                 errcounts[errmsg] += 1
         else:
             prt()
-        res += newres
-    return res, errcounts, skipped_files
+        if sink is None:
+            res += newres
+        else:
+            sink.extend(newres)
+    if manifest is not None:
+        entries = {k: v for k, v in entries.items() if k in found}
+        save_manifest(manifest, entries)
+    return res, errcounts, skipped_files, len(hhfiles)
+
+HAND_START_RE = re.compile(b'PokerStars Hand #[0-9]+: .*\n')
+HAND_END_RE = re.compile(rb'\n\r?\n\Z')
+
+def iter_raw_hands(f, offset=0):
+    """Splits a binary hand history stream into hands in a single pass.
+
+    Yields (start, end, raw) for every hand, where start and end are byte
+    offsets into the stream counted from offset (the position f was opened
+    or seeked at). Memory is bounded by the size of a single hand, and
+    anything before the first hand header is discarded.
+    """
+    buf = None
+    start = pos = offset
+    for line in f:
+        m = HAND_START_RE.search(line)
+        if m:
+            if buf is not None:
+                buf.append(line[:m.start()])
+                yield start, pos + m.start(), b''.join(buf)
+            buf = [line[m.start():]]
+            start = pos + m.start()
+        elif buf is not None:
+            buf.append(line)
+        pos += len(line)
+    if buf is not None:
+        yield start, pos, b''.join(buf)
+
+def iter_finished_hands(f, offset=0, final=False):
+    """Like iter_raw_hands, but holds back a trailing hand that is not
+    terminated by a blank line yet, i.e. one that is still being written,
+    unless final is set (the file is known to be complete).
+    """
+    last = None
+    for item in iter_raw_hands(f, offset):
+        if last is not None:
+            yield last
+        last = item
+    if last is not None and (final or HAND_END_RE.search(last[2])):
+        yield last
+
+# used for the hands that don't decode with the encoding of their stream
+FALLBACK_ENCODING = 'cp1252'
+ENCODING_PROBE_SIZE = 1 << 16
 
-def parse_hhfile(fn):
+def detect_encoding(f):
+    """Encoding of a binary stream, from the bytes at its current position:
+    UTF-8 when they are valid UTF-8 (which includes plain ASCII), else
+    FALLBACK_ENCODING. Nothing is consumed from the stream."""
+    head = f.peek(ENCODING_PROBE_SIZE)[:ENCODING_PROBE_SIZE] if hasattr(f, 'peek') else b''
+    try:
+        # final=False accepts a character cut off at the end of head
+        codecs.getincrementaldecoder('utf-8')().decode(head, final=False)
+        return 'utf-8'
+    except UnicodeDecodeError:
+        return FALLBACK_ENCODING
+
+def decode_hand(raw, encoding=None):
+    if encoding is None:
+        encoding = locale.getpreferredencoding(False)
+    try:
+        text = raw.decode(encoding)
+    except UnicodeDecodeError:
+        text = raw.decode(FALLBACK_ENCODING, errors='replace')
+    return text.replace('\r\n', '\n')
+
+def iter_hands(fn, encoding=None):
+    """Yields the hands of a hand history file one at a time as strings.
+
+    The encoding is detected from the start of the file unless given.
+    """
+    with open_hhfile(fn) as f:
+        if encoding is None:
+            encoding = detect_encoding(f)
+        for _, _, raw in iter_raw_hands(f):
+            yield decode_hand(raw, encoding)
+
+def parse_hhfile(fn, parser='regex'):
     #print(fn)
+    parse = PARSERS[parser]
     errors = []
-    try:
-        with open(fn) as f:
-            txt = f.read()
-    except UnicodeDecodeError as e:
-        errors.append((-1, "UnicodeDecodeError"))
-        return [], errors
-    s = txt
     res = []
-    for i in range(1000000):
-        m = re.search('PokerStars Hand #[0-9]+: .*\n', s)
-        if not m:
-            break  # EOF
-        s2 = s[m.end():]
-        next_m = re.search('PokerStars Hand #[0-9]+: .*\n', s2)
-        if next_m:
-            endidx = next_m.start() + (m.end() - m.start())
-        else:
-            endidx = len(s)
-        hand = s[m.start():endidx]
-        try:
-            parsed = parse_hand(hand)
-            res.append(parsed)
-        except HandParseException as err:
-            errors.append((i, err))
-        s = s[endidx:]
-        # res.append(parsed)
+    try:
+        for i, hand in enumerate(iter_hands(fn)):
+            try:
+                parsed = parse(hand)
+                res.append(parsed)
+            except HandParseException as err:
+                errors.append((i, err))
+    except STREAM_ERRORS as e:
+        return [], [(-1, type(e).__name__)]
     return res, errors
 
+def parse_hhfile_tail(fn, offset=0, parser='regex', final=False):
+    """Parses the finished hands of fn that start at or after byte offset;
+    with final set the trailing hand counts as finished too.
+
+    Returns (res, errors, end), where end is the offset just past the last
+    finished hand, i.e. where the next call should resume.
+    """
+    parse = PARSERS[parser]
+    errors = []
+    res = []
+    end = offset
+    try:
+        with open_hhfile(fn) as f:
+            encoding = detect_encoding(f)
+            f.seek(offset)
+            for i, (_, stop, raw) in enumerate(iter_finished_hands(f, offset, final)):
+                try:
+                    parsed = parse(decode_hand(raw, encoding))
+                    res.append(parsed)
+                except HandParseException as err:
+                    errors.append((i, err))
+                end = stop
+    except STREAM_ERRORS as e:
+        return [], [(-1, type(e).__name__)], offset
+    return res, errors, end
+
 def parse_header(s):
     d = {}
     d['hand_no'] = int(s[s.find('#')+1:s.find(':')])
@@ -436,3 +753,551 @@ def parse_hand(s):
         print(msg)
         raise HandParseException("Total pot doesn't match calculated values")
     return d
+
+#### LINE-ORIENTED PARSER ####
+# parse_hand_sm produces the same dict as parse_hand, but walks the lines of
+# the hand once, collecting what the regex parser finds with re.findall over
+# the whole text, and feeds the street sections to parse_street_lines as
+# ready-split lines. The patterns are the same ones parse_hand uses, compiled
+# once and only tried on lines that pass a cheap substring test. Malformed
+# lines that make parse_hand crash raise HandParseException here instead.
+
+SEATDEF_RE = re.compile(r'Seat [0-9]+: .*[(].[0-9.]+ in chips[)]')
+SEATNICK_RE = re.compile(r': .* [(]')
+SEATSTACK_RE = re.compile(r'[(].[0-9.]+ ')
+SUMMARYNAME_RE = re.compile(r'Seat [0-9]+: [^(]+ [(]')
+POST_RE = re.compile(r'.*: posts [a-z &]+.[0-9.]+')
+ANTE_RE = re.compile(r'.*: posts the ante .[0-9.]+')
+DEALT_RE = re.compile(r'Dealt to .* \[.. ..\]')
+HANDLINE_RE = re.compile(r'Seat [0-9]+: .*\[.*\].*')
+CARDS_RE = re.compile(r'\[[0-9a-z A-Z]+\]')
+POTRAKE_RE = re.compile(r'Total pot .+ [|] Rake .[0-9.]+')
+TOTALPOT_RE = re.compile(r'Total pot .[0-9.]+ ')
+NUMBER_RE = re.compile(r'[0-9.]+')
+BOARD_RE = re.compile(r'Board \[[0-9a-z A-Z]+\]')
+WINNER_RE = re.compile(r'Seat [0-9]+:.*[(].[0-9.]+[)].*')
+PAREN_AMT_RE = re.compile(r'[(].[0-9.]+[)]')
+COLLECTED_RE = re.compile(r'.* collected .[0-9.]+ from pot')
+JOINS_RE = re.compile(r'.+ joins the table at seat #[0-9][ ]*')
+SAID_RE = re.compile(r'.+ said, ".*"')
+STREET_HEADER_RE = re.compile(r'[*]{3} [A-Z ]+ [*]{3}')
+ACTION_RE = re.compile(r': [a-z]+')
+INVEST_RE = re.compile(r'(raises|calls|bets) .[0-9.]+')
+RAISE_TO_RE = re.compile(r'.[0-9.]+')
+STAKES_RE = re.compile(r'[(].[0-9.]+/.[0-9.]+ [A-Z]{3}[)]')
+TIME_RE = re.compile(r' *([0-9]{4}/[0-9]{2}/[0-9]{2} [0-9]{1,2}):([0-5][0-9]):([0-5][0-9]) *')
+
+STREET_MARKERS = ['*** HOLE CARDS ***', '*** FLOP ***', '*** TURN ***',
+                  '*** RIVER ***', '*** SHOW DOWN ***', '*** SUMMARY ***']
+NOISE_SUFFIXES = ("has timed out", 'has timed out while disconnected', 'is disconnected ',
+                  'is connected ', 'leaves the table')
+STREET_PARAMS = [
+    ('preflop', ('*** HOLE CARDS ***', '*** FLOP ***')),
+    ('flop', ('*** FLOP ***', '*** TURN ***')),
+    ('turn', ('*** TURN ***', '*** RIVER ***')),
+    ('river', ('*** RIVER ***', '*** SHOW DOWN ***'))
+]
+
+@functools.lru_cache(maxsize=256)
+def _hour_timestamp(hourstr):
+    return pd.Timestamp(hourstr + ':00:00', tz='US/Eastern')
+
+def parse_timestamp(s):
+    """pd.Timestamp(s, tz='US/Eastern'), localizing only once per hour."""
+    m = TIME_RE.fullmatch(s)
+    if not m:
+        return pd.Timestamp(s, tz='US/Eastern')
+    hourstr, minute, second = m.groups()
+    return _hour_timestamp(hourstr) + timedelta(minutes=int(minute), seconds=int(second))
+
+def parse_header_sm(s):
+    d = {}
+    d['hand_no'] = int(s[s.find('#')+1:s.find(':')])
+    d['game'] = s[s.find(':')+1:s.find('(')].strip()
+    stakestr = STAKES_RE.search(s).group()
+    d['sb'] = float(stakestr[2:stakestr.find('/')])
+    d['bb'] = float(stakestr[stakestr.find('/')+2:stakestr.find(' ')])
+    d['currency'] = stakestr[-4:-1]
+    d['timestamp'] = parse_timestamp(s[s.find('-')+1:])
+    return d
+
+def _isclose(a, b):
+    # np.isclose with its default tolerances, without the array overhead
+    return abs(a - b) <= 1e-08 + 1e-05 * abs(b)
+
+def parse_street_lines(lines, pot_now, baseline=None, antes=None):
+    """parse_street on a street section that is already split into lines."""
+    if baseline:
+        minv = dict(baseline)
+        if antes:
+            for name in minv:
+                minv[name] -= antes[name]
+        himark = max(minv.values())
+    else:
+        minv = {}
+        himark = 0
+    sel_lines = []
+    for line in lines:
+        if line.startswith('Dealt to'):
+            continue
+        if "removed from the table" in line:
+            continue
+        if line.endswith(' from pot') and COLLECTED_RE.fullmatch(line):
+            continue
+        if "doesn't show hand" in line:
+            continue
+        if line.endswith(NOISE_SUFFIXES):
+            continue
+        if 'joins the table' in line and JOINS_RE.fullmatch(line):
+            continue
+        if line.endswith('"') and SAID_RE.fullmatch(line):
+            continue
+        sel_lines.append(line)
+    header = sel_lines[0]
+    streetstr = STREET_HEADER_RE.findall(header)[0][4:-4]
+    if streetstr != 'HOLE CARDS':
+        assert ' ' not in streetstr
+    actions = []
+    uncalled_bet = None
+    for line in sel_lines[1:]:
+        if line.startswith('Uncalled bet'):
+            amt = float(PAREN_AMT_RE.findall(line)[0][2:-1])
+            name = line[line.find('returned to ')+12:]
+            uncalled_bet = (amt, name)
+            break
+        if "has timed out while being disconnected" in line:
+            continue
+        colon = line.rfind(':')
+        m = ACTION_RE.search(line)
+        if colon < 0 or not m:
+            raise HandParseException("Unexpected action line")
+        name = line[:colon]
+        action = m.group()[2:-1]
+        m = INVEST_RE.search(line)  # we take the first number
+        amt = None
+        if m:
+            if name not in minv:
+                minv[name] = 0
+            amtstr = m.group()
+            amt = float(amtstr.split(' ')[-1][1:])
+            to_call = himark - minv[name]
+            if action == 'bet':
+                himark = amt
+                pot_now += amt
+                minv[name] += amt
+            elif action == 'raise':
+                pot_now += amt + to_call
+                amtstr = RAISE_TO_RE.search(line, m.end()).group()
+                himark = float(amtstr.split(' ')[-1][1:])
+                minv[name] = himark
+            elif action == 'call':
+                pot_now += amt
+                minv[name] += amt
+            else:
+                raise Exception("Unexpected investment action: {}".format(action))
+        actions.append((name, action, amt, pot_now, himark))
+    if baseline:
+        for name in minv:
+            minv[name] += antes[name]
+    return actions, uncalled_bet, minv
+
+def _section(lines, start, end):
+    """Lines of s[start:end] where positions are (line index, column) pairs."""
+    if start is None or end is None or end <= start:
+        return []
+    (i0, c0), (i1, c1) = start, end
+    if i0 == i1:
+        return [lines[i0][c0:c1]]
+    res = [lines[i0][c0:]] + lines[i0+1:i1]
+    if c1 > 0:
+        res.append(lines[i1][:c1])
+    return res
+
+def _seats(seatdefs):
+    stacks = {}
+    sd_dict = {}
+    for sd in seatdefs:
+        seat_no = int(sd[sd.find(' ')+1:sd.find(':')])
+        nick = SEATNICK_RE.findall(sd)[0][1:-1].strip()
+        sd_dict[seat_no] = nick
+        amt = float(SEATSTACK_RE.findall(sd)[0][2:-1])
+        stacks[nick] = amt
+    return sd_dict, stacks
+
+def _button_seat(lines):
+    table_line = lines[1] if len(lines) > 1 else ''
+    if '#' in table_line:
+        return int(table_line[table_line.find('#')+1])
+    rest = "\n".join(lines[1:])
+    return int(rest[rest.find('#')+1])
+
+def _relpos(sd_dict, btn_seat, summarylines):
+    relpos_dict = {}
+    relpos_dict[sd_dict[btn_seat]] = 'BTN'
+    for line in summarylines:
+        if '(small blind)' in line:
+            name = SUMMARYNAME_RE.findall(line)[0][8:-2]
+            relpos_dict[name] = 'SB'
+        elif '(big blind)' in line:
+            name = SUMMARYNAME_RE.findall(line)[0][8:-2]
+            relpos_dict[name] = 'BB'
+    cur_suffix = 1
+    for i in range(btn_seat - 2, -10, -1):
+        seat_no = (i % 9) + 1
+        if seat_no in sd_dict:
+            nick = sd_dict[seat_no]
+            if nick in relpos_dict:
+                break
+            relpos_dict[nick] = 'BTN+' + str(cur_suffix)
+            cur_suffix += 1
+    return relpos_dict
+
+def _hero(heroline):
+    if heroline is None:
+        return None, None
+    hero = heroline[9:heroline.find('[')].strip()
+    hhc = heroline[heroline.find('[')+1:heroline.find(']')]
+    return hero, hhc.replace(' ', '')
+
+def _pot_rake(potrake):
+    if potrake is None:
+        raise HandParseException("Total pot line not found")
+    spl = potrake.split('|')
+    rake = float(NUMBER_RE.findall(spl[1])[0])
+    if not TOTALPOT_RE.search(spl[0]):
+        raise HandParseException("Total pot line not found")
+    totalpot = float(NUMBER_RE.findall(spl[0])[0])
+    return totalpot, rake
+
+def _winners(summarylines, sd_dict):
+    winners = []
+    for line in summarylines:
+        if line.startswith('Seat ') and WINNER_RE.fullmatch(line):
+            amt = float(PAREN_AMT_RE.findall(line)[0][2:-1])
+            seatno = int(line[line.find(' ')+1:line.find(':')])
+            nick = sd_dict[seatno]
+            winners.append((nick, amt))
+    return winners
+
+def _board(board_s):
+    if board_s is None:
+        return []
+    return CARDS_RE.findall(board_s)[0][1:-1].replace(' ', '')
+
+def parse_hand_sm(s):
+    if "*** FIRST SHOW DOWN ***" in s:
+        raise HandParseException("Run-it-twice parsing is not supported yet")
+    if "*** SUMMARY ***" not in s:
+        raise HandParseException("Incomplete hand history")
+    lines = s.splitlines()
+    last = len(lines) - 1  # patterns ending in \n never match the last line
+    seatdefs = []
+    posts = []
+    heroline = None
+    handlines = []
+    potrake = None
+    board_s = None
+    markers = {}
+    summary_idx = None
+    cancelled = False
+    for i, line in enumerate(lines):
+        if line == "Hand cancelled":
+            cancelled = True
+        if i == 0:
+            continue
+        if '***' in line:
+            for marker in STREET_MARKERS:
+                if marker not in markers:
+                    col = line.find(marker)
+                    if col >= 0:
+                        markers[marker] = (i, col)
+            if summary_idx is None and line == '*** SUMMARY ***':
+                summary_idx = i
+        if 'in chips)' in line:
+            m = SEATDEF_RE.search(line)
+            if m:
+                seatdefs.append(m.group())
+        if ': posts ' in line and i < last and POST_RE.fullmatch(line):
+            posts.append(line)
+        if heroline is None and 'Dealt to ' in line:
+            m = DEALT_RE.search(line)
+            if m:
+                heroline = m.group()
+        if '[' in line and i < last and 'Seat ' in line:
+            m = HANDLINE_RE.search(line)
+            if m:
+                handlines.append(line[m.start():])
+        if potrake is None and 'Total pot ' in line:
+            m = POTRAKE_RE.search(line)
+            if m:
+                potrake = m.group()
+        if board_s is None and 'Board [' in line:
+            m = BOARD_RE.search(line)
+            if m:
+                board_s = m.group()
+    if cancelled:
+        raise HandParseException("Hand Cancelled")
+    d = parse_header_sm(lines[0])
+    table_line = lines[1] if len(lines) > 1 else ''
+    d['table_name'] = re.findall("'.*'", table_line)[0][1:-1]
+    sd_dict, stacks = _seats(seatdefs)
+    d['sd_dict'] = sd_dict
+    d['stacks'] = stacks
+    if summary_idx is None:
+        # raises the same ValueError as parse_hand
+        summary_idx = lines.index('*** SUMMARY ***')
+    summarylines = lines[summary_idx+1:]
+    relpos_dict = _relpos(sd_dict, _button_seat(lines), summarylines)
+    d['relpos_dict'] = relpos_dict
+    ps_dict = {name: 0 for name in sd_dict.values()}
+    antes = {name: 0 for name in sd_dict.values()}
+    extra_antes = {name: 0 for name in sd_dict.values()}
+    for ps in posts:
+        nick = ps[:ps.rfind(':')]
+        amount = float(ps.split(' ')[-1][1:])
+        ps_dict[nick] += amount
+        if ANTE_RE.fullmatch(ps):
+            antes[nick] = amount
+        if relpos_dict[nick] not in ['SB', 'BB']:
+            if 'posts small & big blinds' in ps or 'posts small blind' in ps:
+                extra_antes[nick] = d['sb']
+    ante = 0
+    if antes:
+        assert len(antes) == len(ps_dict)
+        assert len(set(antes.values())) == 1
+        ante = list(antes.values())[0]
+    d['ante'] = ante
+    d['post_dict'] = ps_dict
+    d['extra_antes'] = extra_antes
+    # same values and types as adding the two dicts as pd.Series
+    if any(type(x) is float for x in itertools.chain(antes.values(), extra_antes.values())):
+        implied_antes = {name: float(antes[name] + extra_antes[name]) for name in antes}
+    else:
+        implied_antes = {name: antes[name] + extra_antes[name] for name in antes}
+    assert len(relpos_dict) == len(sd_dict) == len(ps_dict)
+    holecards = {}
+    d['hero'], hhc = _hero(heroline)
+    if d['hero'] is not None:
+        holecards[d['hero']] = hhc
+    for ss in handlines:
+        seatno = int(ss[ss.find(' ')+1:ss.find(':')])
+        nick = sd_dict[seatno]
+        hc = CARDS_RE.findall(ss)[-1][1:-1].replace(' ', '')
+        holecards[nick] = hc
+    d['holecards'] = holecards
+    totalpot, rake = _pot_rake(potrake)
+    d['totalpot'] = totalpot
+    d['rake'] = rake
+    minv = {}
+    act_dict = {}
+    d['last_street'] = 'showdown'
+    pot_now = sum(ps_dict.values())
+    uncalled_bet = None
+    for street, (start, end) in STREET_PARAMS:
+        end_pos = markers.get(end)
+        last_street = False
+        if end_pos is None:
+            end_pos = markers.get('*** SUMMARY ***')
+            last_street = True
+        section = _section(lines, markers.get(start), end_pos)
+        baseline = None
+        if street == 'preflop':
+            baseline = ps_dict
+        actions, ucb, mistr = parse_street_lines(section, pot_now, baseline, implied_antes)
+        if not uncalled_bet:
+            uncalled_bet = ucb  # in case hand is all-in before river
+        minv[street] = mistr
+        if actions:
+            pot_now = actions[-1][3]
+        act_dict[street] = actions
+        if last_street:
+            d['last_street'] = street
+            break
+    if uncalled_bet:
+        streets, _ = zip(*STREET_PARAMS)
+        for street in streets[::-1]:
+            if street in minv:
+                name = uncalled_bet[1]
+                if name in minv[street]:
+                    minv[street][uncalled_bet[1]] -= uncalled_bet[0]
+                    break
+    minvtot = {name: 0 for name in sd_dict.values()}
+    for name in sd_dict.values():
+        for ms in minv.values():
+            if name in ms:
+                minvtot[name] += ms[name]
+    minv['total'] = minvtot
+    d['minv'] = minv
+    d['act_dict'] = act_dict
+    d['uncalled_bet'] = uncalled_bet
+    winners = _winners(summarylines, sd_dict)
+    d['winners'] = winners
+    d['totalpot_no_rake'] = d['totalpot'] - d['rake']
+    names, amts = zip(*winners)
+    assert _isclose(d['totalpot_no_rake'], sum(amts))
+    rakecontrib = {}
+    for t in winners:
+        name = t[0]
+        amt = t[1]
+        rakecontrib[name] = (amt / d['totalpot_no_rake']) * d['rake']
+    d['rake_contrib'] = rakecontrib
+    d['board'] = _board(board_s)
+    # sanity checks
+    if "flop" in d["act_dict"]:
+        assert len(d["board"]) >= 6
+    if "turn" in d["act_dict"]:
+        assert len(d["board"]) >= 8
+    if "river" in d["act_dict"]:
+        assert len(d["board"]) >= 10
+    if not _isclose(d['totalpot'], sum(minvtot.values())):
+        msg = "\nTotal pot doesn't match calculated values:\n"
+        msg += "Total pot: {}, sum(minvtot.values()): {}".format(d['totalpot'],\
+                sum(minvtot.values()))
+        msg += "\nHand #{}".format(d["hand_no"])
+        print(msg)
+        raise HandParseException("Total pot doesn't match calculated values")
+    return d
+
+#### LAZY HAND RECORD ####
+
+HAND_KEYS = ('hand_no', 'game', 'sb', 'bb', 'currency', 'timestamp', 'table_name',
+             'sd_dict', 'stacks', 'relpos_dict', 'ante', 'post_dict', 'extra_antes',
+             'hero', 'holecards', 'totalpot', 'rake', 'last_street', 'minv', 'act_dict',
+             'uncalled_bet', 'winners', 'totalpot_no_rake', 'rake_contrib', 'board')
+# parsed when the Hand is created; the rest needs a full parse
+HAND_HEADER_KEYS = ('hand_no', 'game', 'sb', 'bb', 'currency', 'table_name', 'sd_dict',
+                    'stacks', 'relpos_dict', 'hero', 'totalpot', 'rake', 'winners',
+                    'totalpot_no_rake', 'board')
+
+class Hand(Mapping):
+    """A hand that is parsed only as far as it is used.
+
+    Creating a Hand parses the header, the seats and the summary: the
+    HAND_HEADER_KEYS fields, which are available as attributes too. The
+    timestamp is parsed on first access, and the streets, investments and
+    everything derived from them by a full parse_hand_sm on first access of
+    any of those keys. Errors that only the full parse detects (e.g. a pot
+    that doesn't add up) are therefore raised at that point.
+
+    A Hand is read-only and behaves like the dict parse_hand returns, with
+    the same keys in the same order; to_dict() makes the real thing.
+    """
+    __slots__ = HAND_HEADER_KEYS + ('_text', '_timestr', '_timestamp', '_full')
+
+    def __init__(self, s):
+        if "*** FIRST SHOW DOWN ***" in s:
+            raise HandParseException("Run-it-twice parsing is not supported yet")
+        if "*** SUMMARY ***" not in s:
+            raise HandParseException("Incomplete hand history")
+        lines = s.splitlines()
+        if "Hand cancelled" in lines:
+            raise HandParseException("Hand Cancelled")
+        header = lines[0]
+        self.hand_no = int(header[header.find('#')+1:header.find(':')])
+        self.game = header[header.find(':')+1:header.find('(')].strip()
+        stakestr = STAKES_RE.search(header).group()
+        self.sb = float(stakestr[2:stakestr.find('/')])
+        self.bb = float(stakestr[stakestr.find('/')+2:stakestr.find(' ')])
+        self.currency = stakestr[-4:-1]
+        self._timestr = header[header.find('-')+1:]
+        self._timestamp = None
+        table_line = lines[1] if len(lines) > 1 else ''
+        self.table_name = re.findall("'.*'", table_line)[0][1:-1]
+        seatdefs = []
+        for line in lines[1:]:
+            if line.startswith('*** '):
+                break
+            if 'in chips)' in line:
+                m = SEATDEF_RE.search(line)
+                if m:
+                    seatdefs.append(m.group())
+        self.sd_dict, self.stacks = _seats(seatdefs)
+        summarylines = lines[lines.index('*** SUMMARY ***')+1:]
+        self.relpos_dict = _relpos(self.sd_dict, _button_seat(lines), summarylines)
+        body = s[len(header):]
+        m = DEALT_RE.search(body)
+        self.hero, _ = _hero(m.group() if m else None)
+        m = POTRAKE_RE.search(body)
+        self.totalpot, self.rake = _pot_rake(m.group() if m else None)
+        self.winners = _winners(summarylines, self.sd_dict)
+        self.totalpot_no_rake = self.totalpot - self.rake
+        m = BOARD_RE.search(body)
+        self.board = _board(m.group() if m else None)
+        self._text = s
+        self._full = None
+
+    @property
+    def timestamp(self):
+        if self._timestamp is None:
+            if self._full is not None:
+                self._timestamp = self._full['timestamp']
+            else:
+                self._timestamp = parse_timestamp(self._timestr)
+        return self._timestamp
+
+    def _parse_full(self):
+        if self._full is None:
+            d = parse_hand_sm(self._text)
+            for key in HAND_HEADER_KEYS:
+                setattr(self, key, d[key])
+            self._full = d
+            self._text = None  # the full dict has it all now
+        return self._full
+
+    def __getattr__(self, key):
+        # only called for keys that are not slots, i.e. the lazy ones
+        if key in HAND_KEYS:
+            return self._parse_full()[key]
+        raise AttributeError(key)
+
+    def __getitem__(self, key):
+        if key in HAND_HEADER_KEYS:
+            return getattr(self, key)
+        if key == 'timestamp':
+            return self.timestamp
+        if key in HAND_KEYS:
+            return self._parse_full()[key]
+        raise KeyError(key)
+
+    def __iter__(self):
+        return iter(HAND_KEYS)
+
+    def __len__(self):
+        return len(HAND_KEYS)
+
+    def __contains__(self, key):
+        return key in HAND_KEYS
+
+    def to_dict(self):
+        return dict(self._parse_full())
+
+    def __repr__(self):
+        return "Hand(#{} '{}')".format(self.hand_no, self.table_name)
+
+PARSERS = {
+    'regex': parse_hand,
+    'sm': parse_hand_sm,
+    'lazy': Hand,
+}
+
+def diff_parsers(fn, parsers=('regex', 'sm')):
+    """Runs two parser engines over fn and yields (i, key, a, b) for every
+    top level key on which their results differ; a failing hand yields
+    key None with the exceptions (or results) of both engines.
+    """
+    pa, pb = PARSERS[parsers[0]], PARSERS[parsers[1]]
+    for i, hand in enumerate(iter_hands(fn)):
+        res = []
+        for parser in (pa, pb):
+            try:
+                res.append(parser(hand))
+            except Exception as err:
+                res.append(err)
+        a, b = res
+        if isinstance(a, Mapping) and isinstance(b, Mapping):
+            for key in a.keys() | b.keys():
+                if a.get(key) != b.get(key):
+                    yield i, key, a.get(key), b.get(key)
+        elif not (isinstance(a, Exception) and isinstance(b, Exception)
+                  and type(a) is type(b) and str(a) == str(b)):
+            yield i, None, a, b
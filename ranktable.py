@@ -0,0 +1,136 @@
+"""Precomputed hand rank tables, memory-mapped for O(1) evaluation.
+
+A table holds the rank of the best high hand of every n-card set, indexed
+by the colexicographic index of the set, so looking a hand up is a few
+table reads and no evaluation. Ranks are dense (0 is the worst high card
+hand, 7461 a royal flush) and order hands like the evaluator codes, so
+they compare the same way but must not be mixed with codes.
+
+    python -m azpoker.ranktable rank_tables --ncards 5 6 7
+
+writes rank_table_5.npy (5 MB), rank_table_6.npy (39 MB) and
+rank_table_7.npy (255 MB). load_rank_tables() maps them read-only, so
+worker processes share the same pages of the OS page cache.
+"""
+import os
+import sys
+import argparse
+import functools
+from math import comb
+import numpy as np
+from azpoker import peval_np
+
+MAX_CARDS = 8
+TABLE_FN = 'rank_table_{}.npy'
+
+def _make_colex_tables():
+    # COLEX[k, v, p]: contribution to the colex index of the cards in suit
+    # mask v of suit k, when p cards of lower suits are in the set
+    binom = np.array([[comb(n, r) for r in range(MAX_CARDS + 14)] for n in range(52)],
+                     dtype=np.int64)
+    v = np.arange(1 << 13)
+    colex = np.zeros((4, 1 << 13, MAX_CARDS), dtype=np.int64)
+    for k in range(4):
+        for b in range(13):
+            isset = (v >> b) & 1
+            below = peval_np.POPCOUNT[v & ((1 << b) - 1)].astype(np.intp)
+            for p in range(MAX_CARDS):
+                colex[k, :, p] += isset * binom[13 * k + b, p + below + 1]
+    return colex
+
+COLEX = _make_colex_tables()
+
+def colex_index(masks):
+    """Colexicographic index of every card mask among the sets of the same size."""
+    masks = np.asarray(masks, dtype=np.int64)
+    index = np.zeros(masks.shape, dtype=np.int64)
+    count = np.zeros(masks.shape, dtype=np.intp)
+    for k in range(4):
+        v = ((masks >> (13 * k)) & peval_np.RANK_MASK).astype(np.intp)
+        index += COLEX[k, v, count]
+        count += peval_np.POPCOUNT[v]
+    return index
+
+def colex_masks(ncards):
+    """All the ncards card masks, in colex order."""
+    masks = (1 << np.arange(52, dtype=np.int64))
+    for n in range(2, ncards + 1):
+        # the sets whose highest card is top follow all the sets of lower
+        # cards, and the rest of them is a prefix of the shorter sets
+        masks = np.concatenate([masks[:comb(top, n - 1)] | (1 << top)
+                                for top in range(n - 1, 52)])
+    return masks
+
+@functools.lru_cache(maxsize=8)
+def subset_masks(deck, k):
+    """Masks of all the k-card sets out of the cards of the tuple deck, in
+    colex order (read-only, shared between calls)."""
+    if k == 0:
+        masks = np.zeros(1, dtype=np.int64)
+    else:
+        # the first comb(n, k) sets of 52 cards in colex order are those of
+        # the lowest n cards; map bit i to deck[i]
+        positions = colex_masks(k)[:comb(len(deck), k)]
+        masks = np.zeros(len(positions), dtype=np.int64)
+        for i, card in enumerate(deck):
+            masks |= ((positions >> i) & 1) << card
+    masks.setflags(write=False)
+    return masks
+
+def _evaluate(masks):
+    return peval_np.evaluate_high(masks, np.zeros(len(masks), dtype=np.int32))
+
+def hand_classes():
+    """Sorted codes of all the distinct 5-card hand values."""
+    return np.unique(_evaluate(colex_masks(5)))
+
+def build_rank_table(fn, ncards, classes=None, verbosity=1):
+    """Writes the rank table for ncards to fn."""
+    if classes is None:
+        classes = hand_classes()
+    shorter = colex_masks(ncards - 1)
+    table = np.lib.format.open_memmap(fn + '.tmp', mode='w+', dtype=np.uint16,
+                                      shape=(comb(52, ncards),))
+    # evaluated in blocks of the sets sharing the same highest card
+    for top in range(ncards - 1, 52):
+        start, end = comb(top, ncards), comb(top + 1, ncards)
+        masks = shorter[:end - start] | (1 << top)
+        table[start:end] = np.searchsorted(classes, _evaluate(masks))
+        if verbosity:
+            print("{}: {:,}/{:,}".format(fn, end, len(table)), end='\r')
+    if verbosity:
+        print()
+    table.flush()
+    del table
+    os.replace(fn + '.tmp', fn)
+
+def load_rank_tables(directory):
+    """Memory-maps the rank tables found in directory, as {ncards: table}."""
+    tables = {}
+    for ncards in range(5, MAX_CARDS):
+        fn = os.path.join(directory, TABLE_FN.format(ncards))
+        if os.path.exists(fn):
+            tables[ncards] = np.load(fn, mmap_mode='r')
+    return tables
+
+def lookup(tables, masks):
+    """Ranks of masks, which must all hold the same number of cards."""
+    masks = np.asarray(masks, dtype=np.int64)
+    if not len(masks):
+        return np.zeros(0, dtype=np.uint16)
+    return tables[bin(int(masks[0])).count('1')][colex_index(masks)]
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(description="Builds the hand rank tables.")
+    ap.add_argument('directory')
+    ap.add_argument('--ncards', type=int, nargs='+', default=[5, 6, 7])
+    args = ap.parse_args(argv)
+    os.makedirs(args.directory, exist_ok=True)
+    classes = hand_classes()
+    for ncards in args.ncards:
+        build_rank_table(os.path.join(args.directory, TABLE_FN.format(ncards)), ncards,
+                         classes)
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -5,6 +5,9 @@ from Cython.Distutils import build_ext
 ext = Extension("peval_ex",
                 sources=['peval_ex.pyx'],
                 language='c++',
-                libraries=['peval'])
+                libraries=['peval'],
+                # for the threads of evaluate_high
+                extra_compile_args=['-fopenmp'],
+                extra_link_args=['-fopenmp'])
 setup(ext_modules=[ext],
       cmdclass={'build_ext': build_ext})
@@ -0,0 +1,206 @@
+"""HUD-style player statistics computed over the columnar hand tables.
+
+The counters behind every stat (hands, VPIP hands, 3-bet opportunities,
+...) are computed for a whole chunk of hands at once from the actions and
+players tables of handstore, summed by (player, position), and added to
+the running totals, so new hands only cost their own chunk:
+
+    st = PlayerStats()
+    st.update_store('store')            # only the chunks not seen yet
+    parse_directory('new_hh', sink=st)  # or parsed hands directly
+    st.table(by='player')
+    st.save('stats.p')
+
+Stats are ratios of the summed counters:
+
+    vpip, pfr       voluntarily put money in / raised preflop, per hand
+    threebet        raised when facing exactly one preflop raise
+    cbet            preflop aggressor bet the flop when checked to
+    fold_cbet       folded to a flop c-bet at the first chance
+    wtsd, wsd       went to showdown after seeing the flop, won at showdown
+    af              postflop bets and raises per call
+    net, bb100      won minus invested (after rake), in money and bb/100 hands
+    rake            rake contributed
+"""
+import pickle
+import numpy as np
+import pandas as pd
+from azpoker import handstore
+from azpoker.handstore import HandBuffer, LAST_STREET_CODE
+
+COUNTERS = ['hands', 'vpip', 'pfr', 'threebet_opp', 'threebet', 'cbet_opp', 'cbet',
+            'fold_cbet_opp', 'fold_cbet', 'saw_flop', 'wtsd', 'wsd', 'aggr', 'calls',
+            'net', 'net_bb', 'rake']
+# stat -> (numerator, denominator) counters
+RATIOS = {
+    'vpip': ('vpip', 'hands'),
+    'pfr': ('pfr', 'hands'),
+    'threebet': ('threebet', 'threebet_opp'),
+    'cbet': ('cbet', 'cbet_opp'),
+    'fold_cbet': ('fold_cbet', 'fold_cbet_opp'),
+    'wtsd': ('wtsd', 'saw_flop'),
+    'wsd': ('wsd', 'wtsd'),
+    'af': ('aggr', 'calls'),
+}
+
+
+def _prior_counts(flags, starts):
+    """Number of True flags before every row within its group, the groups
+    being the runs that begin where starts is True."""
+    flags = flags.astype(np.int64)
+    before = np.cumsum(flags) - flags
+    first = np.maximum.accumulate(np.where(starts, np.arange(len(flags)), 0))
+    return before - before[first]
+
+def _first_per_player(act, sel):
+    """Row mask of the first selected action of every (hand, player)."""
+    rows = np.flatnonzero(sel)
+    keep = ~act.iloc[rows].duplicated(['hand_no', 'player']).to_numpy()
+    mask = np.zeros(len(act), dtype=bool)
+    mask[rows[keep]] = True
+    return mask
+
+def count_chunk(tables, vocabs):
+    """Counter sums of a chunk of hands by (player, position) names.
+
+    tables holds the 'hands', 'actions' and 'players' column arrays of
+    handstore.SCHEMA and vocabs the name lists of their interned ids. A
+    hand is counted as often as it is given, so hands repeated in
+    re-exported files should be dropped upstream (see handindex). Seats
+    that neither posted nor acted don't count.
+    """
+    hands, actions, players = tables['hands'], tables['actions'], tables['players']
+    action_ids = {name: i for i, name in enumerate(vocabs['actions'])}
+    codes = np.asarray(actions['action'])
+
+    def is_action(name):
+        return codes == action_ids.get(name, -1)
+
+    act = pd.DataFrame({'hand_no': actions['hand_no'], 'player': actions['player']})
+    street = np.asarray(actions['street'])
+    call, raise_, bet, fold = (is_action(x) for x in ['call', 'raise', 'bet', 'fold'])
+    aggr = raise_ | bet
+    hand_no = act['hand_no'].to_numpy()
+    starts = np.ones(len(act), dtype=bool)
+    starts[1:] = (hand_no[1:] != hand_no[:-1]) | (street[1:] != street[:-1])
+    # bets and raises before every action on its street
+    prior = _prior_counts(aggr, starts)
+    pre = street == 0
+    flop = street == 1
+    post = street >= 1
+
+    threebet_opp = _first_per_player(act, pre & (prior == 1))
+    # the last preflop raiser of every hand
+    pfa = act[pre & raise_].drop_duplicates('hand_no', keep='last').set_index('hand_no')['player']
+    is_pfa = (act['player'] == act['hand_no'].map(pfa)).to_numpy()
+    cbet_opp = _first_per_player(act, flop & is_pfa & (prior == 0))
+    cbet_hands = act.loc[cbet_opp & bet, 'hand_no'].to_numpy()
+    fold_cbet_opp = _first_per_player(act, flop & ~is_pfa & (prior == 1) &
+                                      np.isin(hand_no, cbet_hands))
+    flags = pd.DataFrame({
+        'hand_no': hand_no,
+        'player': act['player'].to_numpy(),
+        'vpip': pre & (call | raise_),
+        'pfr': pre & raise_,
+        'threebet_opp': threebet_opp,
+        'threebet': threebet_opp & raise_,
+        'cbet_opp': cbet_opp,
+        'cbet': cbet_opp & bet,
+        'fold_cbet_opp': fold_cbet_opp,
+        'fold_cbet': fold_cbet_opp & fold,
+        'aggr': post & aggr,
+        'calls': post & call,
+        'acted': np.ones(len(act), dtype=bool),
+        'folded_pre': pre & fold,
+        'folded': fold,
+    }).groupby(['hand_no', 'player']).sum()
+    # everything but the action counts is a yes/no per hand
+    once = flags.columns.difference(['aggr', 'calls'])
+    flags[once] = flags[once].clip(upper=1)
+
+    pl = pd.DataFrame({'hand_no': players['hand_no'], 'player': players['player'],
+                       'position': players['position']})
+    pl = pl.join(flags, on=['hand_no', 'player'])
+    pl[flags.columns] = pl[flags.columns].fillna(0)
+    hand_info = pd.DataFrame({'last_street': hands['last_street'], 'bb': hands['bb']},
+                             index=pd.Index(hands['hand_no'], name='hand_no'))
+    hand_info = hand_info[~hand_info.index.duplicated()]
+    last_street = pl['hand_no'].map(hand_info['last_street']).to_numpy()
+    bb = pl['hand_no'].map(hand_info['bb']).to_numpy()
+    pl['hands'] = 1
+    pl['saw_flop'] = (last_street >= LAST_STREET_CODE['flop']) & (pl['folded_pre'] == 0)
+    pl['wtsd'] = (last_street == LAST_STREET_CODE['showdown']) & (pl['folded'] == 0)
+    won = np.asarray(players['won'])
+    pl['wsd'] = pl['wtsd'] & (won > 0)
+    pl['net'] = won - np.asarray(players['inv_total'])
+    pl['net_bb'] = pl['net'] / bb
+    pl['rake'] = players['rake_contrib']
+    # seats that sat out or were dealt out neither posted nor acted; a seat
+    # that only posted (e.g. the big blind of a walk) took part
+    pl = pl[(pl['acted'] > 0).to_numpy() | (np.asarray(players['post']) > 0)]
+    counts = pl.groupby(['player', 'position'])[COUNTERS].sum().astype(np.float64)
+    player_names = np.array(vocabs['players'], dtype=object)
+    position_names = np.array(vocabs['positions'], dtype=object)
+    counts.index = pd.MultiIndex.from_arrays(
+        [player_names[counts.index.get_level_values(0)],
+         position_names[counts.index.get_level_values(1)]], names=['player', 'position'])
+    return counts
+
+
+class PlayerStats:
+    """Running counter totals by (player, position), updated chunk by chunk."""
+
+    def __init__(self):
+        self.counts = pd.DataFrame(
+            columns=COUNTERS, dtype=np.float64,
+            index=pd.MultiIndex.from_arrays([[], []], names=['player', 'position']))
+        # store path -> number of its chunks already counted
+        self.store_chunks = {}
+
+    def update(self, tables, vocabs):
+        """Adds a chunk of hands given as column arrays (see count_chunk)."""
+        if not len(tables['players']['hand_no']):
+            return
+        self.counts = self.counts.add(count_chunk(tables, vocabs), fill_value=0)
+
+    def extend(self, hands):
+        """Adds parsed hands, so a PlayerStats can be a parse_directory sink."""
+        buf = HandBuffer()
+        buf.extend(hands)
+        self.update(buf.arrays(), {kind: buf.names(kind) for kind in handstore.VOCABS})
+
+    def update_store(self, path):
+        """Adds the chunks of a handstore that were written since the last call."""
+        vocabs = {kind: handstore.load_vocab(path, kind) for kind in handstore.VOCABS}
+        start = self.store_chunks.get(path, 0)
+        chunks = zip(*(handstore.iter_chunks(path, table) for table in handstore.SCHEMA))
+        n = 0
+        for n, chunk in enumerate(chunks, 1):
+            if n > start:
+                self.update(dict(zip(handstore.SCHEMA, chunk)), vocabs)
+        self.store_chunks[path] = max(start, n)
+
+    def table(self, by='player'):
+        """Stats by 'player', 'position' or, with by=None, by both.
+
+        Ratios without any opportunity are NaN.
+        """
+        counts = self.counts if by is None else self.counts.groupby(level=by).sum()
+        res = pd.DataFrame({'hands': counts['hands']})
+        for stat, (num, den) in RATIOS.items():
+            res[stat] = counts[num] / counts[den].where(counts[den] > 0)
+        res['net'] = counts['net']
+        res['bb100'] = 100 * counts['net_bb'] / counts['hands']
+        res['rake'] = counts['rake']
+        return res
+
+    def save(self, fn):
+        with open(fn, 'wb') as f:
+            pickle.dump((self.counts, self.store_chunks), f, pickle.HIGHEST_PROTOCOL)
+
+    @classmethod
+    def load(cls, fn):
+        st = cls()
+        with open(fn, 'rb') as f:
+            st.counts, st.store_chunks = pickle.load(f)
+        return st
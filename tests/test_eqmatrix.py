@@ -0,0 +1,39 @@
+import numpy as np
+import pytest
+from azpoker import eqmatrix
+from azpoker.canonical import permute_suits
+from azpoker.equity import equity
+from azpoker.handrange import COMBO_INDEX, COMBO_MASKS
+from azpoker.peval import strhand_to_mask
+
+# one uint16 step of rounding on each of the two entries
+TOLERANCE = 2. / eqmatrix.EQUITY_SCALE
+
+
+@pytest.fixture(scope='module')
+def cache_dir(tmp_path_factory):
+    return str(tmp_path_factory.mktemp('equity_matrices'))
+
+@pytest.mark.parametrize('board', ['Ah7d2c9s4h', 'KhQh5c8d'])
+def test_symmetry(board, cache_dir):
+    e = eqmatrix.equities(eqmatrix.equity_matrix(strhand_to_mask(board), cache_dir))
+    valid = ~np.isnan(e)
+    assert (valid == valid.T).all()
+    assert np.abs(e + e.T - 1)[valid].max() <= TOLERANCE
+
+def test_suit_variant(cache_dir):
+    board = strhand_to_mask('KhQh5c8d')
+    # clubs <-> spades, diamonds <-> hearts
+    perm = (3, 2, 1, 0)
+    m = eqmatrix.equity_matrix(board, cache_dir)
+    variant = eqmatrix.equity_matrix(permute_suits(board, perm), cache_dir)
+    index = np.array([COMBO_INDEX[permute_suits(int(c), perm)] for c in COMBO_MASKS])
+    assert (variant[np.ix_(index, index)] == m).all()
+
+def test_against_equity(cache_dir):
+    board = strhand_to_mask('KhQh5c8d')
+    m = eqmatrix.equities(eqmatrix.equity_matrix(board, cache_dir))
+    for hero, villain in [('AhJh', '5d5s'), ('KcKd', 'QsJs')]:
+        h, v = strhand_to_mask(hero), strhand_to_mask(villain)
+        ref = equity([h, v], board=board)[0][0]
+        assert m[COMBO_INDEX[h], COMBO_INDEX[v]] == pytest.approx(ref, abs=TOLERANCE)
@@ -0,0 +1,37 @@
+import itertools
+import pytest
+from azpoker import hhgen
+from azpoker.equity import equity
+from azpoker.peval import strhand_to_mask
+
+
+def enumerated_equity(hero, villain, board):
+    """Hero's equity heads-up over every runout, with hhgen's independent
+    hand evaluator."""
+    used = set(hero + villain + board)
+    deck = [c for c in hhgen.DECK if c not in used]
+    total = 0.
+    runouts = list(itertools.combinations(deck, 5 - len(board)))
+    for runout in runouts:
+        full = board + list(runout)
+        a = hhgen.hand_value(hero + full)[0]
+        b = hhgen.hand_value(villain + full)[0]
+        total += 1. if a > b else .5 if a == b else 0.
+    return total / len(runouts)
+
+def cards(s):
+    return [s[i:i + 2] for i in range(0, len(s), 2)]
+
+@pytest.mark.parametrize('hero, villain, board', [
+    ('AhAs', 'KdKc', '7c8d2h'),
+    ('AhKh', '9s9c', 'Qh7h2c'),
+    ('5c4c', 'AdKs', 'Ac3d2s9h'),
+    ('JsTs', 'JdTd', '2c7h9s'),
+])
+def test_heads_up_exact(hero, villain, board):
+    eqs, stderr = equity([strhand_to_mask(hero), strhand_to_mask(villain)],
+                         board=strhand_to_mask(board))
+    ref = enumerated_equity(cards(hero), cards(villain), cards(board))
+    assert stderr == 0.
+    assert eqs[0] == pytest.approx(ref)
+    assert eqs[0] + eqs[1] == pytest.approx(1.)
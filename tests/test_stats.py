@@ -0,0 +1,45 @@
+import collections
+import pytest
+from azpoker import hhgen, pokerstars_parser, stats
+
+
+@pytest.fixture(scope='module')
+def hands(tmp_path_factory):
+    fn = str(tmp_path_factory.mktemp('hh') / 'hh.txt')
+    hhgen.generate_file(fn, 400, seed=3, maxseats=6)
+    res, errors = pokerstars_parser.parse_hhfile(fn)
+    assert not errors
+    return res
+
+def is_walk(d):
+    pre = d['act_dict'].get('preflop', [])
+    return d['last_street'] == 'preflop' and all(a[1] == 'fold' for a in pre)
+
+def test_totals_with_walks(hands):
+    assert any(is_walk(d) for d in hands)
+    st = stats.PlayerStats()
+    st.extend(hands)
+    counts = st.counts.groupby(level='player').sum()
+    # every seat that posted or acted plays the hand, so the walk's big
+    # blind does too
+    expected = collections.Counter()
+    for d in hands:
+        acted = set(a[0] for actions in d['act_dict'].values() for a in actions)
+        for name in d['sd_dict'].values():
+            if name in acted or d['post_dict'][name] > 0:
+                expected[name] += 1
+    assert counts['hands'].to_dict() == pytest.approx(dict(expected))
+    # the money that leaves the table is the rake
+    assert counts['net'].sum() == pytest.approx(-sum(d['rake'] for d in hands))
+    assert counts['rake'].sum() == pytest.approx(sum(d['rake'] for d in hands))
+
+def test_walk_big_blind(hands):
+    walk = next(d for d in hands if is_walk(d))
+    st = stats.PlayerStats()
+    st.extend([walk])
+    won = {name: amt for name, amt in walk['winners']}
+    counts = st.counts.groupby(level='player').sum()
+    for name, amt in won.items():
+        assert counts.loc[name, 'hands'] == 1
+        assert counts.loc[name, 'net'] == pytest.approx(amt - walk['minv']['total'][name])
+        assert counts.loc[name, 'vpip'] == 0